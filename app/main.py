@@ -123,10 +123,12 @@ async def save_users(data: UsersData):
 async def rag_ask(req: QuestionRequest):
     """RAG 问答接口"""
     import asyncio
+    import time
     from functools import partial
     try:
         from scripts.rag_qa import ask
         loop = asyncio.get_running_loop()
+        started = time.perf_counter()
         result = await asyncio.wait_for(
             loop.run_in_executor(
                 None,
@@ -134,6 +136,7 @@ async def rag_ask(req: QuestionRequest):
             ),
             timeout=28.0,
         )
+        print(f"/api/rag/ask answered in {(time.perf_counter() - started) * 1000:.0f} ms")
         return result
     except asyncio.TimeoutError:
         raise HTTPException(status_code=504, detail="请求超时，请稍后重试（Zhipu API 响应较慢）")
@@ -173,13 +176,13 @@ async def rag_builder_analysis(req: BuilderAnalysisRequest):
 
 @app.post("/api/rag/sync")
 async def rag_sync():
-    """手动从 Pinecone 同步最新推文到本地缓存"""
+    """手动从 Pinecone 同步最新推文到本地缓存（全量比对，远端覆盖写入的记录也会更新）"""
     try:
-        from scripts.rag_store import HAS_PINECONE, _sync_from_pinecone, _load_json_store
+        from scripts.rag_store import HAS_PINECONE, _sync_from_pinecone, _store_count
         if not HAS_PINECONE or not os.environ.get("PINECONE_API_KEY", ""):
             raise HTTPException(status_code=503, detail="Pinecone 未配置，无法同步。请检查 PINECONE_API_KEY 环境变量。")
-        count = _sync_from_pinecone()
-        local_total = len(_load_json_store())
+        count = _sync_from_pinecone(full_refresh=True)
+        local_total = _store_count()
         return {"synced": count, "local_total": local_total, "message": f"同步完成，本地共 {local_total} 条推文"}
     except HTTPException:
         raise
@@ -206,10 +209,15 @@ async def health_check():
     pinecone_ok = False
     pinecone_count = 0
     try:
-        from scripts.rag_store import HAS_PINECONE, get_pinecone_index
+        from scripts.rag_store import HAS_PINECONE, get_pinecone_index, invalidate_pinecone_index
         if HAS_PINECONE and pinecone_key_set:
-            index = get_pinecone_index()
-            stats = index.describe_index_stats()
+            try:
+                index = get_pinecone_index()
+                stats = index.describe_index_stats()
+            except Exception:
+                # 下次请求重新校验索引句柄
+                invalidate_pinecone_index()
+                raise
             pinecone_count = stats.total_vector_count
             pinecone_ok = True
     except Exception:
@@ -217,8 +225,8 @@ async def health_check():
 
     json_count = 0
     try:
-        from scripts.rag_store import _load_json_store
-        json_count = len(_load_json_store())
+        from scripts.rag_store import _store_count
+        json_count = _store_count()
     except Exception:
         pass
 
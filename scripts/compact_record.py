@@ -0,0 +1,144 @@
+"""
+紧凑推文记录模块
+进程内存储快照使用的 __slots__ 记录：username 做字符串驻留，每段文本只保留一份——
+metadata 里重复的 document 不再保存，summary / original_text 能从 document 推出时按需切片还原。
+对外仍兼容 {"id", "document", "metadata"} 的 dict 读取方式（get / [] / to_dict），metadata 在访问时才构建；
+遍历全部记录的索引构建只读个别字段，用 meta_get 直接取字段，不为每条记录构建 metadata dict
+"""
+
+import sys
+
+
+# ingest_tweets 生成 document 的格式：f"{summary}{DOCUMENT_SEPARATOR}{text}"
+DOCUMENT_SEPARATOR = "\n\n原文："
+# original_text 为原文前 500 字
+ORIGINAL_TEXT_LIMIT = 500
+
+# 未出现的 metadata 字段用该哨兵标记，还原时省略
+_MISSING = object()
+
+
+class CompactRecord:
+    """只读的紧凑推文记录"""
+
+    __slots__ = ("id", "document", "username", "datetime", "unix_timestamp", "url",
+                 "_summary", "_original_text", "_meta_document", "extra")
+
+    def __init__(self, record):
+        meta = dict(record.get("metadata") or {})
+        document = record.get("document", "")
+        # metadata 里与顶层相同的 document 只记一个标记
+        self._meta_document = "document" in meta and meta["document"] == document
+        if self._meta_document:
+            del meta["document"]
+
+        self.id = str(record.get("id", ""))
+        self.document = document
+        username = meta.pop("username", _MISSING)
+        self.username = sys.intern(username) if isinstance(username, str) else username
+        self.datetime = meta.pop("datetime", _MISSING)
+        self.unix_timestamp = meta.pop("unix_timestamp", _MISSING)
+        self.url = meta.pop("url", _MISSING)
+
+        summary = meta.pop("summary", _MISSING)
+        text = None
+        if isinstance(summary, str) and summary and DOCUMENT_SEPARATOR not in summary \
+                and document.startswith(summary + DOCUMENT_SEPARATOR):
+            # summary 是 document 的前缀，访问时再切出
+            self._summary = None
+            text = document[len(summary) + len(DOCUMENT_SEPARATOR):]
+        else:
+            self._summary = summary
+            if not summary:
+                text = document
+
+        original_text = meta.pop("original_text", _MISSING)
+        if text is not None and original_text == text[:ORIGINAL_TEXT_LIMIT]:
+            self._original_text = None
+        else:
+            self._original_text = original_text
+
+        # 其余字段（summary_failed、thread_ids 等）原样保留
+        self.extra = meta or None
+
+    @property
+    def summary(self):
+        if self._summary is None:
+            return self.document[:self.document.find(DOCUMENT_SEPARATOR)]
+        return "" if self._summary is _MISSING else self._summary
+
+    @property
+    def original_text(self):
+        if self._original_text is None:
+            if self._summary is None:
+                text = self.document[self.document.find(DOCUMENT_SEPARATOR) + len(DOCUMENT_SEPARATOR):]
+            else:
+                text = self.document
+            return text[:ORIGINAL_TEXT_LIMIT]
+        return "" if self._original_text is _MISSING else self._original_text
+
+    @property
+    def metadata(self):
+        """按入库时的字段顺序构建 metadata dict（每次访问返回新 dict，可放心修改）"""
+        meta = {}
+        for key, value in (("username", self.username), ("datetime", self.datetime),
+                           ("unix_timestamp", self.unix_timestamp), ("url", self.url)):
+            if value is not _MISSING:
+                meta[key] = value
+        if self._summary is not _MISSING:
+            meta["summary"] = self.summary
+        if self._original_text is not _MISSING:
+            meta["original_text"] = self.original_text
+        if self._meta_document:
+            meta["document"] = self.document
+        if self.extra:
+            meta.update(self.extra)
+        return meta
+
+    def meta_get(self, key, default=None):
+        """读取单个 metadata 字段，不构建整个 dict"""
+        if key in ("username", "datetime", "unix_timestamp", "url"):
+            value = getattr(self, key)
+        elif key == "summary":
+            value = _MISSING if self._summary is _MISSING else self.summary
+        elif key == "original_text":
+            value = _MISSING if self._original_text is _MISSING else self.original_text
+        elif key == "document":
+            value = self.document if self._meta_document else _MISSING
+        else:
+            value = self.extra.get(key, _MISSING) if self.extra else _MISSING
+        return default if value is _MISSING else value
+
+    def to_dict(self):
+        """还原为 {"id", "document", "metadata"} 形式"""
+        return {"id": self.id, "document": self.document, "metadata": self.metadata}
+
+    def __getitem__(self, key):
+        if key in ("id", "document", "metadata"):
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key in ("id", "document", "metadata"):
+            return getattr(self, key)
+        return default
+
+    def __contains__(self, key):
+        return key in ("id", "document", "metadata")
+
+
+def compact(record):
+    """dict 记录转为 CompactRecord（已是 CompactRecord 时原样返回）"""
+    return record if isinstance(record, CompactRecord) else CompactRecord(record)
+
+
+def meta_get(record, key, default=None):
+    """读取记录的单个 metadata 字段：CompactRecord 直接取字段，dict 记录走 metadata.get"""
+    if isinstance(record, CompactRecord):
+        return record.meta_get(key, default)
+    return (record.get("metadata") or {}).get(key, default)
+
+
+def to_dict(record):
+    """CompactRecord 还原为 dict（已是 dict 时原样返回）"""
+    return record.to_dict() if isinstance(record, CompactRecord) else record
@@ -0,0 +1,121 @@
+"""
+本地 Embedding 缓存模块
+以 (模型, 维度, sha256(文档)) 为键持久化 embedding，重建 Pinecone 索引、更换索引名时无需重新调用智谱 API
+存储格式：每个 (模型, 维度) 一个目录，vectors.f16 为按行追加的 float16 矩阵（以 memmap 方式读取），
+keys.txt 每行一个文档 sha256，与矩阵行号一一对应
+"""
+
+import os
+import hashlib
+import threading
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+
+EMBEDDING_CACHE_DIR = os.environ.get(
+    "EMBEDDING_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "embedding_cache"),
+)
+
+
+def document_key(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """单个 (模型, 维度) 的 embedding 缓存，线程安全，只追加写入"""
+
+    def __init__(self, model, dim, cache_dir=EMBEDDING_CACHE_DIR):
+        if not HAS_NUMPY:
+            raise ImportError("numpy 未安装，请运行 pip install numpy")
+        self.model = model
+        self.dim = dim
+        self.dir = os.path.join(cache_dir, f"{model}-{dim}")
+        self.vectors_path = os.path.join(self.dir, "vectors.f16")
+        self.keys_path = os.path.join(self.dir, "keys.txt")
+        self._lock = threading.Lock()
+        self._matrix = None
+        os.makedirs(self.dir, exist_ok=True)
+        self._rows = self._load_keys()
+
+    def _load_keys(self):
+        """读取 key -> 行号映射；以矩阵与 key 文件中较短者为准（防止写入中断导致错位）"""
+        keys = []
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, "r", encoding="utf-8") as f:
+                keys = [line.strip() for line in f if line.strip()]
+        row_bytes = self.dim * 2
+        stored_rows = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+        n = min(len(keys), stored_rows)
+        if n != len(keys) or n != stored_rows:
+            # 截掉不完整的尾部，保持两份文件行数一致
+            with open(self.keys_path, "w", encoding="utf-8") as f:
+                f.writelines(key + "\n" for key in keys[:n])
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(n * row_bytes)
+        return {key: row for row, key in enumerate(keys[:n])}
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _get_matrix(self):
+        """以只读 memmap 打开向量矩阵；有新行写入后重新映射"""
+        n = len(self._rows)
+        if n == 0:
+            return None
+        if self._matrix is None or self._matrix.shape[0] < n:
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float16, mode="r", shape=(n, self.dim))
+        return self._matrix
+
+    def get_many(self, texts):
+        """返回与 texts 对应的向量列表（float32 list），未命中的位置为 None"""
+        with self._lock:
+            matrix = self._get_matrix()
+            results = []
+            for text in texts:
+                row = self._rows.get(document_key(text))
+                results.append(None if row is None else matrix[row].astype(np.float32).tolist())
+            return results
+
+    def put_many(self, texts, vectors):
+        """追加写入新向量（已存在的文档跳过）"""
+        with self._lock:
+            new_keys = []
+            new_vectors = []
+            for text, vector in zip(texts, vectors):
+                key = document_key(text)
+                if key in self._rows or key in new_keys:
+                    continue
+                new_keys.append(key)
+                new_vectors.append(vector)
+            if not new_keys:
+                return 0
+
+            # 先写矩阵再写 key，中断时 _load_keys 会按较短者对齐
+            with open(self.vectors_path, "ab") as f:
+                f.write(np.asarray(new_vectors, dtype=np.float16).tobytes())
+            with open(self.keys_path, "a", encoding="utf-8") as f:
+                f.writelines(key + "\n" for key in new_keys)
+            start = len(self._rows)
+            for offset, key in enumerate(new_keys):
+                self._rows[key] = start + offset
+            return len(new_keys)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(model, dim):
+    """获取进程级缓存实例；numpy 不可用或 EMBEDDING_CACHE_DIR 设为空时返回 None"""
+    if not HAS_NUMPY or not EMBEDDING_CACHE_DIR:
+        return None
+    with _caches_lock:
+        key = (model, dim)
+        if key not in _caches:
+            _caches[key] = EmbeddingCache(model, dim)
+        return _caches[key]
@@ -0,0 +1,242 @@
+"""
+关键词倒排索引模块
+关键词降级检索使用：入库时按与查询侧相同的规则切词（中英文词块 + 连续中文的 2-4 字子串），
+维护 词 -> (文档序号, 词频) 倒排表与 username 倒排表，查询只遍历命中词的倒排链并按 BM25 打分
+索引以 pickle 持久化在本地存储旁，入库时增量追加；被覆盖的旧记录打墓碑，墓碑过多时由调用方整体重建
+安装了 numpy 时打分向量化计算，否则退回纯 Python 循环
+"""
+
+import os
+import math
+import heapq
+import pickle
+import re
+from array import array
+from collections import Counter
+
+from scripts.compact_record import meta_get
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+
+KEYWORD_INDEX_PATH = os.environ.get(
+    "KEYWORD_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "keyword_index.pkl"),
+)
+
+# BM25 参数
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# 中英文词块（查询侧 _extract_keywords 与文档侧 tokenize 共用，都经 word_terms 规整）
+TOKEN_PATTERN = re.compile(r"[\u4e00-\u9fff]{2,}|[a-z0-9_#@.-]{2,}")
+CJK_RUN_PATTERN = re.compile(r"[\u4e00-\u9fff]{3,}")
+# 英文词块内部的分隔符：openai. / #agents / gpt-5 拆成 openai、agents、gpt
+_WORD_SEPARATORS = re.compile(r"[#@.-]+")
+
+# 墓碑占比超过该值时需要整体重建
+_COMPACT_RATIO = 0.25
+_FORMAT_VERSION = 2
+
+
+def word_terms(text):
+    """
+    中英文词块：英文词块去掉首尾的 #@.- 后按分隔符拆开（至少 2 个字符的部分），
+    仍含 . 或 - 的复合词（gpt-5、node.js）额外保留整体，精确查询也能命中
+    """
+    terms = []
+    for token in TOKEN_PATTERN.findall((text or "").lower()):
+        token = token.strip("#@.-")
+        parts = [p for p in _WORD_SEPARATORS.split(token) if len(p) >= 2]
+        terms.extend(parts)
+        if len(token) >= 2 and parts != [token]:
+            terms.append(token)
+    return terms
+
+
+def tokenize(text):
+    """
+    文档切词：word_terms 的中英文词块，加上每段连续中文的 2-4 字子串（与查询侧补充的子串同一规则）
+
+    >>> tokenize("Launched gpt-5 with OpenAI. Try #agents")
+    ['launched', 'gpt', 'gpt-5', 'with', 'openai', 'try', 'agents']
+    """
+    text = (text or "").lower()
+    terms = word_terms(text)
+    for run in CJK_RUN_PATTERN.findall(text):
+        # 等长子串就是词块本身，已在上面收录
+        for n in (2, 3, 4):
+            if n < len(run):
+                terms.extend(run[i:i + n] for i in range(0, len(run) - n + 1))
+    return terms
+
+
+def record_text(record):
+    """参与索引的文本：document + summary（与原线性扫描一致）"""
+    return record.get("document", "") + " " + meta_get(record, "summary", "")
+
+
+class KeywordIndex:
+    """BM25 倒排索引；文档序号只增不减，覆盖写入时旧序号记为墓碑"""
+
+    def __init__(self, signature=None):
+        self.ids = []
+        self.doc_lengths = array("I")
+        self.postings = {}
+        self.user_postings = {}
+        self.positions = {}
+        self.deleted = set()
+        self.total_length = 0
+        self.signature = signature
+
+    def __len__(self):
+        return len(self.ids) - len(self.deleted)
+
+    @property
+    def needs_compaction(self):
+        return len(self.deleted) > _COMPACT_RATIO * max(len(self.ids), 1)
+
+    def copy(self):
+        """独立副本：增量写入在副本上进行，查询线程仍可无锁读取原索引"""
+        index = KeywordIndex(signature=self.signature)
+        index.ids = list(self.ids)
+        index.doc_lengths = array("I", self.doc_lengths)
+        index.postings = {term: (array("I", docs), array("I", tfs)) for term, (docs, tfs) in self.postings.items()}
+        index.user_postings = {name: array("I", docs) for name, docs in self.user_postings.items()}
+        index.positions = dict(self.positions)
+        index.deleted = set(self.deleted)
+        index.total_length = self.total_length
+        return index
+
+    def add(self, records):
+        """追加记录（同 ID 覆盖：旧序号打墓碑）"""
+        for r in records:
+            rid = str(r.get("id", ""))
+            old = self.positions.get(rid)
+            if old is not None:
+                self.deleted.add(old)
+                self.total_length -= self.doc_lengths[old]
+
+            doc = len(self.ids)
+            self.ids.append(rid)
+            self.positions[rid] = doc
+            terms = tokenize(record_text(r))
+            self.doc_lengths.append(len(terms))
+            self.total_length += len(terms)
+            for term, tf in Counter(terms).items():
+                posting = self.postings.get(term)
+                if posting is None:
+                    posting = self.postings[term] = (array("I"), array("I"))
+                posting[0].append(doc)
+                posting[1].append(tf)
+
+            username = (meta_get(r, "username", "") or "").lower()
+            self.user_postings.setdefault(username, array("I")).append(doc)
+
+    def search(self, terms, top_k=5, username=None):
+        """
+        BM25 打分 top-k，返回 [(id, score)]，按分数降序；username 不区分大小写
+
+        >>> index = KeywordIndex.build([{"id": "1", "document": "Launched gpt-5 with OpenAI. Try #agents"}])
+        >>> [rid for rid, _ in index.search(["openai"])], [rid for rid, _ in index.search(["agents"])]
+        (['1'], ['1'])
+        """
+        total = len(self)
+        if not total or not terms:
+            return []
+
+        allowed = None
+        if username:
+            docs = self.user_postings.get(username.lower())
+            if not docs:
+                return []
+            allowed = set(docs)
+
+        avg_length = self.total_length / total or 1.0
+        if HAS_NUMPY:
+            return self._search_numpy(terms, top_k, allowed, total, avg_length)
+
+        scores = {}
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            docs, tfs = posting
+            df = len(docs)
+            idf = math.log(1.0 + (total - df + 0.5) / (df + 0.5))
+            for doc, tf in zip(docs, tfs):
+                if doc in self.deleted or (allowed is not None and doc not in allowed):
+                    continue
+                norm = BM25_K1 * (1.0 - BM25_B + BM25_B * self.doc_lengths[doc] / avg_length)
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * (BM25_K1 + 1.0) / (tf + norm)
+
+        top = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [(self.ids[doc], score) for doc, score in top]
+
+    def _search_numpy(self, terms, top_k, allowed, total, avg_length):
+        """search 的向量化实现：倒排链复制为 numpy 数组后整体计算，常见词的长倒排链也无需逐条循环"""
+        lengths = np.array(self.doc_lengths, dtype=np.float32)
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        allowed_mask = None
+        if allowed is not None:
+            allowed_mask = np.zeros(len(self.ids), dtype=bool)
+            allowed_mask[np.fromiter(allowed, dtype=np.int64, count=len(allowed))] = True
+
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            docs = np.array(posting[0], dtype=np.int64)
+            tfs = np.array(posting[1], dtype=np.float32)
+            idf = math.log(1.0 + (total - len(docs) + 0.5) / (len(docs) + 0.5))
+            if allowed_mask is not None:
+                keep = allowed_mask[docs]
+                docs, tfs = docs[keep], tfs[keep]
+            norm = BM25_K1 * (1.0 - BM25_B + BM25_B * lengths[docs] / avg_length)
+            # 同一个词的倒排链里文档序号不重复，可直接按下标累加
+            scores[docs] += idf * tfs * (BM25_K1 + 1.0) / (tfs + norm)
+
+        if self.deleted:
+            scores[np.fromiter(self.deleted, dtype=np.int64, count=len(self.deleted))] = 0.0
+        candidates = np.flatnonzero(scores > 0)
+        if candidates.size == 0:
+            return []
+        k = min(top_k, candidates.size)
+        top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[doc], float(scores[doc])) for doc in top]
+
+    def save(self, path=None):
+        """原子写入 pickle 文件"""
+        path = path or KEYWORD_INDEX_PATH
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump((_FORMAT_VERSION, self.__dict__), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=None):
+        """加载索引；文件不存在、损坏或格式版本不符时返回 None"""
+        path = path or KEYWORD_INDEX_PATH
+        try:
+            with open(path, "rb") as f:
+                version, state = pickle.load(f)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            return None
+        if version != _FORMAT_VERSION:
+            return None
+        index = cls()
+        index.__dict__.update(state)
+        return index
+
+    @classmethod
+    def build(cls, records, signature=None):
+        """从全部记录构建索引"""
+        index = cls(signature=signature)
+        index.add(records)
+        return index
@@ -0,0 +1,61 @@
+"""
+智谱 API 客户端模块
+进程内共享一个带连接池（keep-alive）的 OpenAI 兼容客户端，
+摘要、Embedding、问答、趋势分析按调用类型使用各自的超时
+"""
+
+import os
+import threading
+
+import httpx
+from openai import OpenAI
+
+
+ZHIPU_BASE_URL = "https://open.bigmodel.cn/api/paas/v4"
+
+# 各调用类型的超时（秒），可通过环境变量覆盖
+LLM_TIMEOUTS = {
+    # embedding 快速超时，失败后降级关键词搜索
+    "embedding": float(os.environ.get("LLM_TIMEOUT_EMBEDDING", "8")),
+    "qa": float(os.environ.get("LLM_TIMEOUT_QA", "25")),
+    "trends": float(os.environ.get("LLM_TIMEOUT_TRENDS", "25")),
+    "summary": float(os.environ.get("LLM_TIMEOUT_SUMMARY", "120")),
+}
+
+# 连接池大小：需覆盖 summarize.py 的并发请求数
+LLM_POOL_MAX_CONNECTIONS = int(os.environ.get("LLM_POOL_MAX_CONNECTIONS", "20"))
+LLM_POOL_KEEPALIVE_SECONDS = float(os.environ.get("LLM_POOL_KEEPALIVE_SECONDS", "60"))
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _get_base_client(api_key):
+    """按 API Key 缓存底层客户端，所有调用共享同一个 httpx 连接池"""
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=LLM_POOL_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_POOL_MAX_CONNECTIONS,
+                    keepalive_expiry=LLM_POOL_KEEPALIVE_SECONDS,
+                ),
+            )
+            # 重试由 scripts.resilience 统一处理，关闭 SDK 自带的重试避免叠加
+            client = OpenAI(api_key=api_key, base_url=ZHIPU_BASE_URL, http_client=http_client, max_retries=0)
+            _clients[api_key] = client
+        return client
+
+
+def get_client(kind, api_key=None):
+    """
+    获取指定调用类型的客户端
+    kind: embedding / qa / trends / summary，决定请求超时
+    api_key: 默认读取 ZHIPU_API_KEY 环境变量
+    返回的客户端与同进程其他调用共享连接池，不会重复 TLS 握手
+    """
+    api_key = api_key or os.environ.get("ZHIPU_API_KEY", "")
+    if not api_key:
+        raise ValueError("ZHIPU_API_KEY 环境变量未设置")
+    return _get_base_client(api_key).with_options(timeout=LLM_TIMEOUTS[kind])
@@ -0,0 +1,159 @@
+"""
+本地向量索引模块
+未配置 Pinecone 时的离线语义检索：归一化后的向量矩阵（float32，或 float16 以减半体积）以 memmap 方式加载，
+余弦相似度 top-k 按行分块做矩阵乘（float16 矩阵逐块转换为 float32，不会整体复制），
+username / unix_timestamp 过滤通过布尔掩码预先筛选候选行
+"""
+
+import os
+import json
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+
+LOCAL_INDEX_DIR = os.environ.get(
+    "LOCAL_INDEX_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "vector_index"),
+)
+# 向量矩阵的存储精度：float32 检索最快；float16 体积减半，检索时逐块转换为 float32 计算
+LOCAL_INDEX_DTYPE = os.environ.get("LOCAL_INDEX_DTYPE", "float32")
+# 检索时每块的行数：float16 矩阵每次只转换这么多行
+LOCAL_INDEX_CHUNK_ROWS = int(os.environ.get("LOCAL_INDEX_CHUNK_ROWS", "8192"))
+
+
+def _save_npy(path, array):
+    """先写临时文件再替换：已用 memmap 打开旧文件的索引继续读旧内容，不会读到写了一半的数据"""
+    tmp_path = path + ".tmp.npy"
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+class LocalVectorIndex:
+    """只读的本地向量索引；用 build() 生成、load() 加载"""
+
+    def __init__(self, ids, usernames, username_codes, timestamps, matrix, signature=None):
+        self.ids = ids
+        self.usernames = usernames
+        self._username_lookup = {name: code for code, name in enumerate(usernames)}
+        self.username_codes = username_codes
+        self.timestamps = timestamps
+        self.matrix = matrix
+        self.signature = signature
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def _paths(index_dir):
+        return (
+            os.path.join(index_dir, "vectors.npy"),
+            os.path.join(index_dir, "usernames.npy"),
+            os.path.join(index_dir, "timestamps.npy"),
+            os.path.join(index_dir, "meta.json"),
+        )
+
+    @classmethod
+    def build(cls, index_dir, ids, usernames, timestamps, vectors, signature=None, dim=0):
+        """
+        归一化向量并写入 index_dir，返回以 memmap 方式加载的索引
+        ids / usernames / timestamps / vectors 一一对应；没有任何向量时写入 (0, dim) 的空矩阵
+        """
+        if not HAS_NUMPY:
+            raise ImportError("numpy 未安装，请运行 pip install numpy")
+        os.makedirs(index_dir, exist_ok=True)
+        vectors_path, usernames_path, timestamps_path, meta_path = cls._paths(index_dir)
+
+        if len(ids):
+            matrix = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+        else:
+            # 空数组无法按 -1 推断列数
+            matrix = np.zeros((0, dim), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        _save_npy(vectors_path, (matrix / norms).astype(LOCAL_INDEX_DTYPE))
+
+        vocabulary = sorted({(u or "").lower() for u in usernames})
+        lookup = {name: code for code, name in enumerate(vocabulary)}
+        _save_npy(usernames_path, np.asarray([lookup[(u or "").lower()] for u in usernames], dtype=np.int32))
+        _save_npy(timestamps_path, np.asarray([int(ts or 0) for ts in timestamps], dtype=np.int64))
+
+        # meta.json 最后写入：它存在即表示索引完整
+        tmp_meta_path = meta_path + ".tmp"
+        with open(tmp_meta_path, "w", encoding="utf-8") as f:
+            json.dump({"ids": list(ids), "usernames": vocabulary, "signature": signature}, f)
+        os.replace(tmp_meta_path, meta_path)
+        return cls.load(index_dir)
+
+    @classmethod
+    def load(cls, index_dir):
+        """加载索引，向量矩阵以只读 memmap 打开；索引不存在时返回 None"""
+        if not HAS_NUMPY:
+            return None
+        vectors_path, usernames_path, timestamps_path, meta_path = cls._paths(index_dir)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        return cls(
+            ids=meta["ids"],
+            usernames=meta["usernames"],
+            username_codes=np.load(usernames_path),
+            timestamps=np.load(timestamps_path),
+            matrix=np.load(vectors_path, mmap_mode="r"),
+            signature=meta.get("signature"),
+        )
+
+    def search(self, query_vector, top_k=5, username=None, since_ts=None):
+        """余弦相似度 top-k，返回 [(id, score)]，按分数降序"""
+        if not self.ids:
+            return []
+
+        mask = None
+        if username:
+            code = self._username_lookup.get(username.lower())
+            if code is None:
+                return []
+            mask = self.username_codes == code
+        if since_ts:
+            ts_mask = self.timestamps >= int(since_ts)
+            mask = ts_mask if mask is None else (mask & ts_mask)
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        query /= norm
+
+        if mask is None:
+            candidates = None
+            vectors = self.matrix
+        else:
+            candidates = np.flatnonzero(mask)
+            if candidates.size == 0:
+                return []
+            vectors = self.matrix[candidates]
+        scores = self._scores(vectors, query)
+
+        k = min(top_k, scores.shape[0])
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        rows = top if candidates is None else candidates[top]
+        return [(self.ids[row], float(scores[i])) for row, i in zip(rows, top)]
+
+    @staticmethod
+    def _scores(vectors, query):
+        """
+        逐块计算 vectors @ query：float32 矩阵直接计算；
+        numpy 的 float16 矩阵乘没有 BLAS 加速，每块转为 float32 后计算，临时内存只有一块的大小
+        """
+        if vectors.dtype == np.float32:
+            return vectors @ query
+        scores = np.empty(vectors.shape[0], dtype=np.float32)
+        for start in range(0, vectors.shape[0], LOCAL_INDEX_CHUNK_ROWS):
+            chunk = vectors[start:start + LOCAL_INDEX_CHUNK_ROWS]
+            scores[start:start + len(chunk)] = chunk.astype(np.float32) @ query
+        return scores
@@ -5,7 +5,8 @@ RAG 问答模块
 
 import os
 import json
-from openai import OpenAI
+from scripts.llm_client import get_client
+from scripts.resilience import call_with_retry
 from scripts.rag_store import search_tweets, get_all_tweets_stats
 
 
@@ -108,6 +109,9 @@ def ask(question, n_results=5, username=None, db_path=None):
         }
 
 
+    # 实际贡献了结果的检索路径（vector / keyword）
+    retrieval = sorted({leg for r in results for leg in r.get("retrieval", [])})
+
     # 2. 构建上下文
     context = format_context(results)
 
@@ -122,17 +126,15 @@ def ask(question, n_results=5, username=None, db_path=None):
         return {
             "answer": "（ZHIPU_API_KEY 未配置，无法生成智能回答，以下为相关推文检索结果）\n\n" + "\n\n".join(summaries),
             "sources": [{"username": r["metadata"].get("username", ""), "datetime": r["metadata"].get("datetime", ""), "url": r["metadata"].get("url", ""), "summary": r["metadata"].get("summary", "")} for r in results],
+            "retrieval": retrieval,
         }
 
-    client = OpenAI(
-        api_key=api_key,
-        base_url="https://open.bigmodel.cn/api/paas/v4",
-        timeout=25.0,
-    )
+    client = get_client("qa", api_key=api_key)
 
     prompt = QA_USER_PROMPT.format(context=context, question=question)
 
-    response = client.chat.completions.create(
+    # 接口超时接近请求总时限，只尝试一次；熔断时快速失败
+    response = call_with_retry("qa", lambda: client.chat.completions.create(
         model="glm-4.7",
         messages=[
             {"role": "system", "content": QA_SYSTEM_PROMPT},
@@ -141,7 +143,7 @@ def ask(question, n_results=5, username=None, db_path=None):
         temperature=0.3,
         max_tokens=1500,
         extra_body={"thinking": {"type": "disabled"}},
-    )
+    ), max_attempts=1)
 
     answer = response.choices[0].message.content.strip()
 
@@ -159,6 +161,7 @@ def ask(question, n_results=5, username=None, db_path=None):
     return {
         "answer": answer,
         "sources": sources,
+        "retrieval": retrieval,
     }
 
 
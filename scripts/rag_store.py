@@ -1,15 +1,32 @@
 """
 RAG 向量存储模块
 使用 Pinecone + 智谱 Embedding 管理推文向量数据库
-本地 JSON 作为运行时缓存（启动时从 Pinecone 同步），不再提交到 git
+本地 JSON 作为运行时缓存（启动时从 Pinecone 增量同步），不再提交到 git
 """
 
 import os
 import json
 import hashlib
 import re
-from datetime import datetime, timedelta
-from openai import OpenAI
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FuturesTimeout, wait
+from types import MappingProxyType
+
+# 以 python scripts/rag_store.py 方式运行时，确保项目根目录在 Python 路径中
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from scripts import tweet_store
+from scripts.compact_record import compact, meta_get, to_dict
+from scripts.embedding_cache import get_embedding_cache
+from scripts.keyword_index import KEYWORD_INDEX_PATH, KeywordIndex, word_terms
+from scripts.local_vector_index import HAS_NUMPY, LOCAL_INDEX_DIR, LocalVectorIndex
+from scripts.llm_client import get_client
+from scripts.resilience import call_with_retry, print_metrics_summary
+from scripts.stats_rollup import STATS_ROLLUP_PATH, StatsRollup
+from scripts.time_index import TimeIndex, parse_timestamp, record_timestamp
 
 try:
     from pinecone import Pinecone, ServerlessSpec
@@ -21,127 +38,337 @@ except ImportError:
 # JSON 存储路径（不依赖 Pinecone）
 TWEETS_JSON_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "tweets_store.json")
 
+# 本地存储后端：json（data/tweets_store.json，整文件读写）或 sqlite（data/tweets_store.sqlite，增量写入）
+TWEETS_STORE_BACKEND = os.environ.get("TWEETS_STORE_BACKEND", "json").lower()
+
 # Pinecone 配置
 PINECONE_INDEX_NAME = os.environ.get("PINECONE_INDEX_NAME", "tweets")
-EMBEDDING_DIM = 2048  # 智谱 embedding-3 维度
+EMBEDDING_MODEL = "embedding-3"
+EMBEDDING_DIM = int(os.environ.get("EMBEDDING_DIM", "2048"))  # 智谱 embedding-3 维度
+
+# Pinecone metadata 模式：full（完整 metadata，含 document/summary/original_text）/
+# lean（只保留过滤字段 username、unix_timestamp 和 id，检索后从本地存储补全记录）
+PINECONE_METADATA_MODE = os.environ.get("PINECONE_METADATA_MODE", "full").lower()
+
+# Pinecone upsert：单次请求的序列化体积上限（Pinecone 上限 2MB，留出余量）与并发请求数
+PINECONE_UPSERT_MAX_BYTES = int(os.environ.get("PINECONE_UPSERT_MAX_BYTES", "1500000"))
+PINECONE_UPSERT_CONCURRENCY = int(os.environ.get("PINECONE_UPSERT_CONCURRENCY", "4"))
+
+# 增量同步：每次 fetch 的 ID 数、同时在途的 fetch 页数，以及同步水位文件
+PINECONE_FETCH_BATCH = int(os.environ.get("PINECONE_FETCH_BATCH", "1000"))
+PINECONE_SYNC_CONCURRENCY = int(os.environ.get("PINECONE_SYNC_CONCURRENCY", "4"))
+PINECONE_SYNC_STATE_PATH = os.path.join(os.path.dirname(TWEETS_JSON_PATH), "pinecone_sync.json")
+# 全量比对间隔（秒）：远端条数不变时也定期 fetch 全部记录，发现同 ID 的覆盖写入；0 表示只在手动同步时比对
+PINECONE_FULL_REFRESH_INTERVAL = float(os.environ.get("PINECONE_FULL_REFRESH_INTERVAL", "21600"))
+
+# Pinecone 索引句柄在进程内复用，超过该秒数后重新校验一次（describe_index）
+PINECONE_INDEX_TTL = float(os.environ.get("PINECONE_INDEX_TTL", "300"))
+
+# 向量检索后端：auto（配置了 PINECONE_API_KEY 用 Pinecone，否则用本地 NumPy 索引）/ pinecone / local
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "auto").lower()
+
+# 检索模式：hybrid（向量与关键词并发检索，RRF 融合）/ fallback（先向量检索，无结果再关键词匹配）
+SEARCH_MODE = os.environ.get("SEARCH_MODE", "hybrid").lower()
+# hybrid 模式下向量检索的等待上限（秒），超时后只用关键词结果
+SEARCH_VECTOR_DEADLINE = float(os.environ.get("SEARCH_VECTOR_DEADLINE", "2.5"))
+# hybrid 模式下向量检索有结果时，关键词结果的 BM25 分数下限：低于它的弱匹配不参与融合
+# 单个词满分约等于其 idf，3.0 约相当于命中一个只出现在 5% 推文中的词
+SEARCH_KEYWORD_MIN_SCORE = float(os.environ.get("SEARCH_KEYWORD_MIN_SCORE", "3.0"))
+# RRF 融合常数：排名 r 的得分为 1 / (RRF_K + r)
+RRF_K = 60
+
+# 查询向量 LRU 缓存：最多缓存条数，及过期秒数（0 表示不过期）
+QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", "256"))
+QUERY_EMBEDDING_CACHE_TTL = float(os.environ.get("QUERY_EMBEDDING_CACHE_TTL", "0"))
+
+# 智谱 embedding 接口单次请求最多 64 条输入；同时在途的批次数
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_CONCURRENCY = int(os.environ.get("EMBEDDING_CONCURRENCY", "4"))
 
 
 def get_embedding_client():
-    """获取智谱 Embedding 客户端"""
-    api_key = os.environ.get("ZHIPU_API_KEY", "")
-    if not api_key:
-        raise ValueError("ZHIPU_API_KEY 环境变量未设置")
-    return OpenAI(
-        api_key=api_key,
-        base_url="https://open.bigmodel.cn/api/paas/v4",
-        timeout=8.0,  # embedding 快速超时，失败后降级关键词搜索
-    )
+    """获取智谱 Embedding 客户端（共享连接池，快速超时，失败后降级关键词搜索）"""
+    return get_client("embedding")
+
 
+def get_embeddings(texts, client=None, max_attempts=None, use_cache=True):
+    """
+    使用智谱 API 生成文本 embedding，返回顺序与 texts 一致
+    先查本地 embedding 缓存（见 scripts.embedding_cache），只为未命中的文本调用 API；
+    每次请求发送最多 EMBEDDING_BATCH_SIZE 条文本，最多 EMBEDDING_CONCURRENCY 个批次并发
+    max_attempts: 单个批次最多尝试次数（含重试），默认见 scripts.resilience
+    use_cache: 是否读写本地缓存（在线查询传 False，避免把查询语句写入文档缓存）
+    """
+    # 截断过长文本
+    truncated = [text[:2000] if len(text) > 2000 else text for text in texts]
+
+    cache = get_embedding_cache(EMBEDDING_MODEL, EMBEDDING_DIM) if use_cache else None
+    embeddings = cache.get_many(truncated) if cache is not None else [None] * len(truncated)
+    missing = [i for i, emb in enumerate(embeddings) if emb is None]
+    if not missing:
+        return embeddings
 
-def get_embeddings(texts, client=None):
-    """使用智谱 API 生成文本 embedding"""
     if client is None:
         client = get_embedding_client()
 
-    embeddings = []
-    for text in texts:
-        # 截断过长文本
-        truncated = text[:2000] if len(text) > 2000 else text
-        response = client.embeddings.create(
-            model="embedding-3",
-            input=truncated
-        )
-        embeddings.append(response.data[0].embedding)
+    pending = [truncated[i] for i in missing]
+    batches = [pending[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(pending), EMBEDDING_BATCH_SIZE)]
+
+    def _embed_batch(batch):
+        response = call_with_retry("embedding", lambda: client.embeddings.create(
+            model=EMBEDDING_MODEL,
+            input=batch,
+            dimensions=EMBEDDING_DIM,
+        ), max_attempts=max_attempts)
+        # 按 index 排序，保证与输入顺序一致
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    fetched = []
+    if len(batches) == 1:
+        fetched = _embed_batch(batches[0])
+    else:
+        with ThreadPoolExecutor(max_workers=min(EMBEDDING_CONCURRENCY, len(batches))) as pool:
+            for batch_embeddings in pool.map(_embed_batch, batches):
+                fetched.extend(batch_embeddings)
+
+    for i, emb in zip(missing, fetched):
+        embeddings[i] = emb
+    if cache is not None:
+        cache.put_many(pending, fetched)
     return embeddings
 
 
+_query_embedding_cache = OrderedDict()
+_query_embedding_lock = threading.Lock()
+
+
+def get_query_embedding(query):
+    """
+    生成查询向量，带进程内 LRU 缓存（键为模型、维度与规整后的查询文本）
+    趋势分析的固定查询词、模板化的 builder 查询、重复提问都不再调用 embedding 接口
+    """
+    normalized = " ".join((query or "").split()).lower()
+    key = (EMBEDDING_MODEL, EMBEDDING_DIM, normalized)
+    now = time.monotonic()
+
+    with _query_embedding_lock:
+        entry = _query_embedding_cache.get(key)
+        if entry is not None:
+            embedding, created = entry
+            if not QUERY_EMBEDDING_CACHE_TTL or now - created < QUERY_EMBEDDING_CACHE_TTL:
+                _query_embedding_cache.move_to_end(key)
+                return embedding
+            del _query_embedding_cache[key]
+
+    # 在线查询不重试：失败后直接降级关键词搜索，熔断时也不再等待超时
+    embedding = get_embeddings([normalized], client=get_embedding_client(), max_attempts=1, use_cache=False)[0]
+
+    with _query_embedding_lock:
+        _query_embedding_cache[key] = (embedding, now)
+        _query_embedding_cache.move_to_end(key)
+        while len(_query_embedding_cache) > QUERY_EMBEDDING_CACHE_SIZE:
+            _query_embedding_cache.popitem(last=False)
+    return embedding
+
+
+_pinecone_client = None
+_pinecone_index = None
+_pinecone_host = None
+_pinecone_index_at = 0.0
+_pinecone_index_verified = False
+_pinecone_lock = threading.Lock()
+
+
 def get_pinecone_index():
-    """获取 Pinecone 索引（不存在则自动创建）"""
+    """
+    获取 Pinecone 索引（不存在则自动创建）
+    句柄在进程内复用：索引是否存在每个进程只检查一次，之后每 PINECONE_INDEX_TTL 秒
+    或调用方报错（invalidate_pinecone_index）后才重新 describe_index 校验
+    """
+    global _pinecone_client, _pinecone_index, _pinecone_host, _pinecone_index_at, _pinecone_index_verified
+
     if not HAS_PINECONE:
         raise ImportError("pinecone 未安装，请运行 pip install pinecone")
     api_key = os.environ.get("PINECONE_API_KEY", "")
     if not api_key:
         raise ValueError("PINECONE_API_KEY 环境变量未设置")
 
-    pc = Pinecone(api_key=api_key)
-    index_name = PINECONE_INDEX_NAME
+    with _pinecone_lock:
+        if _pinecone_index is not None and time.monotonic() - _pinecone_index_at < PINECONE_INDEX_TTL:
+            return _pinecone_index
+
+        if _pinecone_client is None:
+            _pinecone_client = Pinecone(api_key=api_key)
+        pc = _pinecone_client
+        index_name = PINECONE_INDEX_NAME
+
+        if not _pinecone_index_verified:
+            existing = [idx.name for idx in pc.list_indexes()]
+            if index_name not in existing:
+                pc.create_index(
+                    name=index_name,
+                    dimension=EMBEDDING_DIM,
+                    metric="cosine",
+                    spec=ServerlessSpec(cloud="aws", region="us-east-1"),
+                )
+            _pinecone_index_verified = True
 
-    existing = [idx.name for idx in pc.list_indexes()]
-    if index_name not in existing:
-        pc.create_index(
-            name=index_name,
-            dimension=EMBEDDING_DIM,
-            metric="cosine",
-            spec=ServerlessSpec(cloud="aws", region="us-east-1"),
-        )
+        try:
+            host = pc.describe_index(index_name).host
+        except Exception:
+            # 索引可能已被删除：下次调用重新检查是否存在
+            _pinecone_index = None
+            _pinecone_index_verified = False
+            raise
 
-    return pc.Index(index_name)
+        # host 未变时沿用原句柄（保留其连接池）
+        if _pinecone_index is None or host != _pinecone_host:
+            _pinecone_index = pc.Index(host=host)
+            _pinecone_host = host
+        _pinecone_index_at = time.monotonic()
+        return _pinecone_index
 
 
-def _filter_tweets_by_days(tweets, days=None):
-    """按时间范围过滤推文列表"""
-    if not days or not tweets:
-        return tweets
+def invalidate_pinecone_index():
+    """Pinecone 调用出错后调用：下次 get_pinecone_index 时重新校验索引"""
+    global _pinecone_index
+    with _pinecone_lock:
+        _pinecone_index = None
 
-    cutoff = datetime.utcnow() - timedelta(days=days)
-    filtered = []
-    for t in tweets:
-        dt_str = t.get("metadata", {}).get("datetime", "")
-        if not dt_str:
-            filtered.append(t)
-            continue
 
-        try:
-            for fmt in ["%Y-%m-%dT%H:%M:%S.%fZ", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%SZ", "%Y-%m-%d"]:
-                try:
-                    dt = datetime.strptime(dt_str[:26], fmt)
-                    break
-                except ValueError:
-                    continue
-            else:
-                filtered.append(t)
-                continue
-            if dt >= cutoff:
-                filtered.append(t)
-        except Exception:
-            filtered.append(t)
+def _load_sync_watermark():
+    """读取上次同步的水位（Pinecone 条数 + 同步后本地存储签名）"""
+    try:
+        with open(PINECONE_SYNC_STATE_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-    return filtered
 
+def _save_sync_watermark(remote_count, lean_ids=(), remote_ids=(), full_refresh_at=0):
+    """
+    记录同步水位：Pinecone 条数未变且本地存储未改动时，下次同步只需一次 stats 调用
+    lean_ids: 远端只有 lean metadata、无法还原到本地的向量 ID，下次同步不再 fetch
+    remote_ids: 本次列举到的远端全部 ID，下次列举时据此发现远端删除
+    full_refresh_at: 上次全量比对的时间
+    """
+    state = {
+        "index": PINECONE_INDEX_NAME,
+        "remote_count": remote_count,
+        "local_signature": _store_signature(),
+        "full_refresh_at": full_refresh_at,
+        "lean_ids": sorted(lean_ids),
+        "remote_ids": sorted(remote_ids),
+    }
+    os.makedirs(os.path.dirname(PINECONE_SYNC_STATE_PATH), exist_ok=True)
+    with open(PINECONE_SYNC_STATE_PATH, "w", encoding="utf-8") as f:
+        json.dump(state, f)
 
-def _sync_from_pinecone():
-    """从 Pinecone 全量拉取所有推文 metadata，写入本地 JSON 缓存。返回同步条数。"""
-    index = get_pinecone_index()
 
-    # list() 返回 ID 分页生成器
-    all_ids = []
-    for ids_page in index.list():
-        all_ids.extend(ids_page)
+def _store_ids():
+    """本地存储已有的全部推文 ID"""
+    if _use_sqlite():
+        return tweet_store.all_ids()
+    return set(_load_store_snapshot()[1])
 
-    if not all_ids:
+
+def _sync_from_pinecone(remote_count=None, full_refresh=False):
+    """
+    从 Pinecone 同步推文 metadata 到本地存储。返回新增或更新的条数。
+    增量同步：对比远端与本地 ID，只 fetch 本地缺失的记录（多页并发），合并写入本地存储。
+    全量比对（full_refresh=True，或距上次超过 PINECONE_FULL_REFRESH_INTERVAL 秒）：fetch 全部记录，
+    同 ID 被覆盖写入（修复的摘要、变长的推文串）时更新本地记录——远端条数不变时增量同步发现不了这类变化。
+    每次列举都会删除上次列举到、这次已不在远端的本地记录。
+    lean metadata 的向量没有正文，无法还原为本地记录：其 ID 记入水位，之后的同步跳过
+    """
+    index = get_pinecone_index()
+    if remote_count is None:
+        remote_count = index.describe_index_stats().total_vector_count
+
+    watermark = _load_sync_watermark()
+    same_index = watermark.get("index") == PINECONE_INDEX_NAME
+    now = int(time.time())
+    full_refresh_at = watermark.get("full_refresh_at", 0) if same_index else 0
+    full_refresh = full_refresh or (
+        PINECONE_FULL_REFRESH_INTERVAL > 0 and now - full_refresh_at >= PINECONE_FULL_REFRESH_INTERVAL
+    )
+    if (not full_refresh and same_index
+            and watermark.get("remote_count") == remote_count
+            and watermark.get("local_signature") == _store_signature()):
+        print(f"Local cache up to date (watermark: {remote_count} vectors)")
         return 0
 
-    tweets = []
-    for i in range(0, len(all_ids), 1000):
-        batch_ids = all_ids[i:i + 1000]
+    local_ids = _store_ids()
+    known_lean = set(watermark.get("lean_ids") or []) if same_index else set()
+    previous_remote = set(watermark.get("remote_ids") or []) if same_index else set()
+
+    def _fetch(batch_ids):
         result = index.fetch(ids=batch_ids)
+        records, lean = [], []
         for vid, vec in result.vectors.items():
-            meta = dict(vec.metadata or {})
-            tweets.append({
+            if _is_lean_metadata(vec.metadata):
+                lean.append(vid)
+                continue
+            records.append({
                 "id": vid,
-                "document": meta.get("document", ""),
-                "metadata": meta,
+                "document": (vec.metadata or {}).get("document", ""),
+                "metadata": dict(vec.metadata or {}),
             })
+        return records, lean
+
+    # list() 返回 ID 分页生成器：边列举边提交需要 fetch 的 ID，同时最多 PINECONE_SYNC_CONCURRENCY 页在途
+    records = []
+    lean_ids = set()
+    remote_ids = set()
+    futures = []
+    pending = []
+    with ThreadPoolExecutor(max_workers=PINECONE_SYNC_CONCURRENCY) as pool:
+        for ids_page in index.list():
+            for vid in ids_page:
+                remote_ids.add(vid)
+                if vid in known_lean and vid not in local_ids:
+                    # 只保留远端仍存在的 lean ID
+                    lean_ids.add(vid)
+                    continue
+                if vid in local_ids and not full_refresh:
+                    continue
+                pending.append(vid)
+            while len(pending) >= PINECONE_FETCH_BATCH:
+                futures.append(pool.submit(_fetch, pending[:PINECONE_FETCH_BATCH]))
+                pending = pending[PINECONE_FETCH_BATCH:]
+        if pending:
+            futures.append(pool.submit(_fetch, pending))
+        for future in futures:
+            fetched, lean = future.result()
+            lean_ids.update(vid for vid in lean if vid not in local_ids)
+            if full_refresh:
+                # 只写入本地缺失或内容有变化的记录
+                local = _get_store_records([r["id"] for r in fetched])
+                fetched = [
+                    r for r in fetched
+                    if r["id"] not in local
+                    or local[r["id"]].get("metadata") != r["metadata"]
+                    or local[r["id"]].get("document") != r["document"]
+                ]
+            records.extend(fetched)
 
-    _save_json_store(tweets)
-    print(f"Synced {len(tweets)} tweets from Pinecone to local cache")
-    return len(tweets)
+    if records:
+        _upsert_store_records(records)
+    deleted = (previous_remote - remote_ids) & local_ids
+    if deleted:
+        _delete_store_records(deleted)
+    _save_sync_watermark(remote_count, lean_ids, remote_ids, full_refresh_at=now if full_refresh else full_refresh_at)
+    print(f"Synced {len(records)} new or updated tweets from Pinecone to local cache"
+          + (" (full refresh)" if full_refresh else "")
+          + (f", removed {len(deleted)} deleted remotely" if deleted else "")
+          + (f" ({len(lean_ids)} lean vectors not in local store, skipped)" if lean_ids else ""))
+    return len(records)
 
 
 def ensure_vector_store_ready():
     """
-    启动时将 Pinecone 数据同步到本地 JSON 缓存（供趋势分析/关键词搜索使用）。
-    本地缓存条数 < Pinecone 时触发全量同步。
+    启动时将 Pinecone 数据增量同步到本地缓存（供趋势分析/关键词搜索使用）。
+    水位未变时只花一次 describe_index_stats 调用。
     返回 True 表示 Pinecone 可用，False 表示不可用。
     """
     if not HAS_PINECONE or not os.environ.get("PINECONE_API_KEY", ""):
@@ -154,15 +381,10 @@ def ensure_vector_store_ready():
         if pinecone_count == 0:
             return False
 
-        local_count = len(_load_json_store())
-        if local_count >= pinecone_count:
-            print(f"Local cache up to date ({local_count} tweets)")
-            return True
-
-        print(f"Local cache ({local_count}) behind Pinecone ({pinecone_count}), syncing...")
-        synced = _sync_from_pinecone()
-        return synced > 0
+        _sync_from_pinecone(remote_count=pinecone_count)
+        return True
     except Exception as e:
+        invalidate_pinecone_index()
         print(f"Warning: failed to sync from Pinecone ({e})")
         return False
 
@@ -177,6 +399,50 @@ def tweet_id_hash(tweet):
     return hashlib.md5(text.encode()).hexdigest()
 
 
+def get_stored_tweets(ids):
+    """
+    按推文 ID 查询已入库的记录，返回 {id: record}
+    先查本地 JSON 缓存，缺失的 ID 再到 Pinecone 批量 fetch（未配置时跳过）
+    """
+    wanted = {str(i) for i in ids if i}
+    if not wanted:
+        return {}
+
+    found = _get_store_records(wanted)
+
+    missing = [i for i in wanted if i not in found]
+    if missing and HAS_PINECONE and os.environ.get("PINECONE_API_KEY", ""):
+        try:
+            index = get_pinecone_index()
+            for i in range(0, len(missing), 1000):
+                result = index.fetch(ids=missing[i:i + 1000])
+                for vid, vec in result.vectors.items():
+                    if _is_lean_metadata(vec.metadata):
+                        continue
+                    meta = dict(vec.metadata or {})
+                    found[vid] = {
+                        "id": vid,
+                        "document": meta.get("document", ""),
+                        "metadata": meta,
+                    }
+        except Exception as e:
+            invalidate_pinecone_index()
+            print(f"Warning: failed to look up stored tweets in Pinecone ({e})")
+
+    return found
+
+
+def _thread_ids(record):
+    """记录覆盖的推文 ID 集合：合并的推文串为 thread_ids，普通推文为自身 ID"""
+    return {str(i) for i in record.get("metadata", {}).get("thread_ids") or [record.get("id")]}
+
+
+def _is_failed_record(record):
+    """记录的摘要是否生成失败（兼容未带 summary_failed 标记的旧数据）"""
+    meta = record.get("metadata", {})
+    return bool(meta.get("summary_failed")) or meta.get("summary", "").startswith("（摘要生成失败")
+
+
 def ingest_tweets(tweets_file, db_path=None):
     """
     将推文数据导入 Pinecone 向量数据库
@@ -197,109 +463,299 @@ def ingest_tweets(tweets_file, db_path=None):
         summary = t.get("summary", "")
         text = t.get("text", "")
         doc = f"{summary}\n\n原文：{text}" if summary else text
+        summary_failed = bool(t.get("summary_failed"))
 
         username = t.get("username", "unknown").lower().strip()
         dt = t.get("datetime", "")
         url = t.get("url", "")
 
-        # 转成 Unix 时间戳，供 Pinecone 数值范围过滤使用
-        unix_ts = 0
-        for fmt in ["%Y-%m-%dT%H:%M:%S.%fZ", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%SZ",
-                    "%Y-%m-%d", "%a %b %d %H:%M:%S +0000 %Y"]:
-            try:
-                unix_ts = int(datetime.strptime(dt[:29], fmt).timestamp())
-                break
-            except (ValueError, OSError):
-                continue
+        # 转成 Unix 时间戳，供 Pinecone 数值范围过滤与本地时间索引使用
+        unix_ts = parse_timestamp(dt)
+
+        metadata = {
+            "username": username,
+            "datetime": dt,
+            "unix_timestamp": unix_ts,
+            "url": url,
+            "summary": summary,
+            "original_text": text[:500],
+            "document": doc,
+        }
+        if summary_failed:
+            # 标记摘要生成失败的记录，后续运行拿到正常摘要时覆盖
+            metadata["summary_failed"] = True
+        if t.get("thread_ids"):
+            # 自回复推文串合并后的记录，保留串内全部推文 ID
+            metadata["thread_ids"] = [str(i) for i in t["thread_ids"]]
 
         all_tweet_records.append({
             "id": tid,
             "document": doc,
-            "metadata": {
-                "username": username,
-                "datetime": dt,
-                "unix_timestamp": unix_ts,
-                "url": url,
-                "summary": summary,
-                "original_text": text[:500],
-                "document": doc,
-            },
+            "metadata": metadata,
         })
 
-    # 更新本地 JSON 缓存（运行时使用，非持久化存储）
-    existing = _load_json_store()
-    existing_ids = {t["id"] for t in existing}
-    new_records = [r for r in all_tweet_records if r["id"] not in existing_ids]
+    # 更新本地缓存（运行时使用，非持久化存储）：只查询本批推文 ID，增量写入
+    # 查到的旧记录原样传给 _upsert_store_records，写入时不再重复查询
+    existing = _get_store_records([r["id"] for r in all_tweet_records])
+    previous = {}
+    new_records = []
+    repaired = 0
+    for r in all_tweet_records:
+        old = existing.get(r["id"])
+        if old is None:
+            existing[r["id"]] = r
+            new_records.append(r)
+        elif (_is_failed_record(old) and not _is_failed_record(r)) or not _thread_ids(r) <= _thread_ids(old):
+            # 之前摘要生成失败的推文，用这次的正常摘要覆盖（Pinecone 同 ID upsert 即覆盖）；
+            # 推文串首条曾单独（或以更短的串）入库，这次合并出了新的后续推文：用完整的串覆盖
+            previous.setdefault(r["id"], old)
+            existing[r["id"]] = r
+            new_records.append(r)
+            repaired += 1
 
     if not new_records:
         print("All tweets already in store.")
         return 0
 
-    existing.extend(new_records)
-    _save_json_store(existing)
+    total = _upsert_store_records(new_records, previous=previous)
     ingested = len(new_records)
-    print(f"New tweets: {ingested}, local cache total: {len(existing)}")
+    print(f"New tweets: {ingested - repaired}, repaired summaries / grown threads: {repaired}, local cache total: {total}")
 
     # 尝试同时写入 Pinecone（可选，用于向量搜索）
     use_pinecone = HAS_PINECONE and os.environ.get("PINECONE_API_KEY", "") and os.environ.get("ZHIPU_API_KEY", "")
     if use_pinecone:
         try:
             index = get_pinecone_index()
-            embedding_client = get_embedding_client()
-
-            ids = [r["id"] for r in new_records]
-            documents = [r["document"] for r in new_records]
-            metadatas = [r["metadata"] for r in new_records]
-
-            batch_size = 20
-            pinecone_ingested = 0
-            for i in range(0, len(ids), batch_size):
-                batch_ids = ids[i:i + batch_size]
-                batch_docs = documents[i:i + batch_size]
-                batch_meta = metadatas[i:i + batch_size]
-                batch_embeddings = get_embeddings(batch_docs, client=embedding_client)
-                vectors = [
-                    {"id": vid, "values": emb, "metadata": meta}
-                    for vid, emb, meta in zip(batch_ids, batch_embeddings, batch_meta)
-                ]
-                index.upsert(vectors=vectors)
-                pinecone_ingested += len(batch_ids)
-                print(f"  Pinecone: {pinecone_ingested}/{len(ids)} tweets")
-
+            _pipelined_pinecone_ingest(index, new_records, get_embedding_client())
             stats = index.describe_index_stats()
             print(f"Pinecone total: {stats.total_vector_count}")
         except Exception as e:
+            invalidate_pinecone_index()
             print(f"Warning: Pinecone ingestion failed ({e}), JSON store is still up to date.")
+    elif _resolve_vector_backend() == "local" and HAS_NUMPY and os.environ.get("ZHIPU_API_KEY", ""):
+        # 无 Pinecone 时为本地向量索引生成 embedding（写入本地缓存）并重建索引
+        try:
+            get_embeddings([r["document"] for r in new_records])
+            print(f"Local vector index: embedded {len(new_records)} tweets")
+            # 入库时就重建索引，检索请求不必等待重建
+            get_local_vector_index(wait=True)
+        except Exception as e:
+            print(f"Warning: embedding for local vector index failed ({e}), keyword search still works.")
 
     return ingested
 
 
+def _pinecone_metadata(record):
+    """写入 Pinecone 的 metadata：full 模式为完整 metadata，lean 模式只保留过滤字段和 id"""
+    meta = record["metadata"]
+    if PINECONE_METADATA_MODE != "lean":
+        return meta
+    return {
+        "id": record["id"],
+        "username": meta.get("username", ""),
+        "unix_timestamp": record_timestamp(record),
+    }
+
+
+def _is_lean_metadata(meta):
+    """Pinecone 里的 metadata 是否为 lean 模式（不含正文字段）"""
+    meta = meta or {}
+    return not any(key in meta for key in ("document", "summary", "original_text"))
+
+
+def _vector_payload_bytes(vector):
+    """估算单条向量 upsert 请求体的序列化字节数（浮点数按 JSON 文本约 20 字节计）"""
+    meta_bytes = len(json.dumps(vector["metadata"], ensure_ascii=False).encode("utf-8"))
+    return len(vector["values"]) * 20 + meta_bytes + len(vector["id"]) + 64
+
+
+def _pack_upsert_batches(vectors, max_bytes=None):
+    """按序列化体积把向量切成多次 upsert 请求，每次不超过 max_bytes 且最多 1000 条"""
+    max_bytes = max_bytes or PINECONE_UPSERT_MAX_BYTES
+    batches = []
+    batch = []
+    batch_bytes = 0
+    for v in vectors:
+        size = _vector_payload_bytes(v)
+        if batch and (batch_bytes + size > max_bytes or len(batch) >= 1000):
+            batches.append(batch)
+            batch = []
+            batch_bytes = 0
+        batch.append(v)
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _pipelined_pinecone_ingest(index, records, embedding_client):
+    """
+    流水线写入 Pinecone：主线程生成第 N+1 轮 embedding 时，第 N 轮的 upsert 在有界线程池中执行
+    upsert 按序列化体积分批；在途请求超过 2 × PINECONE_UPSERT_CONCURRENCY 时先等待最早完成的一批
+    返回写入条数
+    """
+    # 每轮 embedding 可并发发出 EMBEDDING_CONCURRENCY 个批量请求
+    batch_size = EMBEDDING_BATCH_SIZE * EMBEDDING_CONCURRENCY
+    total = len(records)
+    upserted = 0
+    started = time.monotonic()
+
+    def _collect(done):
+        nonlocal upserted
+        for future in done:
+            upserted += future.result()
+        elapsed = max(time.monotonic() - started, 1e-6)
+        print(f"  Pinecone: {upserted}/{total} tweets ({upserted / elapsed:.1f} vectors/s)")
+
+    def _upsert(vectors):
+        index.upsert(vectors=vectors)
+        return len(vectors)
+
+    pending = set()
+    with ThreadPoolExecutor(max_workers=PINECONE_UPSERT_CONCURRENCY) as pool:
+        for i in range(0, total, batch_size):
+            batch = records[i:i + batch_size]
+            embeddings = get_embeddings([r["document"] for r in batch], client=embedding_client)
+            vectors = [
+                {"id": r["id"], "values": emb, "metadata": _pinecone_metadata(r)}
+                for r, emb in zip(batch, embeddings)
+            ]
+            for chunk in _pack_upsert_batches(vectors):
+                pending.add(pool.submit(_upsert, chunk))
+            while len(pending) > 2 * PINECONE_UPSERT_CONCURRENCY:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                _collect(done)
+            # 非阻塞地收集已完成的批次，及时报告进度
+            done = {f for f in pending if f.done()}
+            if done:
+                pending -= done
+                _collect(done)
+        if pending:
+            done, _ = wait(pending)
+            _collect(done)
+
+    elapsed = max(time.monotonic() - started, 1e-6)
+    print(f"Pinecone ingest: {upserted} vectors in {elapsed:.1f}s ({upserted / elapsed:.1f} vectors/s)")
+    return upserted
+
+
+# 向量检索在后台线程执行；超过截止时间时还在排队的调用直接取消，已开始的在后台跑完后丢弃结果（查询向量仍会写入 LRU 缓存）
+_search_pool = ThreadPoolExecutor(max_workers=4)
+
+
 def search_tweets(query, n_results=5, username=None, db_path=None, since_ts=None):
     """
     检索与查询相关的推文
-    优先使用向量检索（Pinecone + embedding），不可用时自动降级为关键词匹配。
+    hybrid 模式：向量检索与关键词检索并发执行，向量检索最多等待 SEARCH_VECTOR_DEADLINE 秒。
+    向量检索有结果时，BM25 分数不低于 SEARCH_KEYWORD_MIN_SCORE 的关键词结果与之按 RRF 融合；
+    向量检索无结果或超时时，与 fallback 模式一样只用关键词结果。
+    fallback 模式：优先向量检索，无结果时降级为关键词匹配。
+    每条结果的 retrieval 字段列出命中它的检索路径（vector / keyword）。
     since_ts: 可选，Unix 时间戳，只返回该时间之后的推文
     """
-    vector_results = _search_vector(query, n_results, username, since_ts=since_ts)
+    if SEARCH_MODE != "hybrid":
+        vector_results = _search_vector(query, n_results, username, since_ts=since_ts)
+        if vector_results:
+            return [dict(r, retrieval=["vector"]) for r in vector_results]
+
+        # 降级：关键词匹配
+        return [dict(r, retrieval=["keyword"]) for r in _search_keyword(query, n_results, username, since_ts=since_ts)]
+
+    started = time.monotonic()
+    vector_future = _search_pool.submit(_search_vector, query, n_results, username, since_ts)
+    keyword_results = _search_keyword(query, n_results, username, since_ts=since_ts, recent_fallback=False)
+    try:
+        vector_results = vector_future.result(timeout=max(0.0, SEARCH_VECTOR_DEADLINE - (time.monotonic() - started)))
+    except FuturesTimeout:
+        # 还在排队的取消掉，避免超时请求占满线程池；已开始的调用结果不再读取
+        vector_future.cancel()
+        print(f"Vector search missed the {SEARCH_VECTOR_DEADLINE}s deadline, using keyword results only")
+        vector_results = []
+
     if vector_results:
-        return vector_results
+        # 关键词结果的 distance 为 1 / (1 + BM25 分数)
+        keyword_results = [r for r in keyword_results if 1.0 / r["distance"] - 1.0 >= SEARCH_KEYWORD_MIN_SCORE]
+    fused = _rrf_fuse([("vector", vector_results), ("keyword", keyword_results)], n_results)
+    if not fused and username:
+        # 两路都没有结果时，兜底返回该用户最近 N 条推文
+        return [dict(r, retrieval=["keyword"]) for r in _recent_tweet_results(username, n_results, since_ts)]
+    return fused
 
-    # 降级：关键词匹配
-    return _search_keyword(query, n_results, username)
+
+def _rrf_fuse(ranked_lists, n_results):
+    """
+    倒数排名融合（Reciprocal Rank Fusion）：每路排名 r 贡献 1 / (RRF_K + r)
+    同一条推文保留最先出现的那一路的结果字段，retrieval 列出全部命中路径
+    """
+    fused = {}
+    for leg, results in ranked_lists:
+        for rank, r in enumerate(results, start=1):
+            entry = fused.get(r["id"])
+            if entry is None:
+                entry = fused[r["id"]] = dict(r, retrieval=[], rrf_score=0.0)
+            entry["retrieval"].append(leg)
+            entry["rrf_score"] += 1.0 / (RRF_K + rank)
+    return sorted(fused.values(), key=lambda r: r["rrf_score"], reverse=True)[:n_results]
+
+
+def _resolve_vector_backend():
+    """返回实际使用的向量检索后端：pinecone 或 local"""
+    if VECTOR_BACKEND in ("pinecone", "local"):
+        return VECTOR_BACKEND
+    return "pinecone" if HAS_PINECONE and os.environ.get("PINECONE_API_KEY", "") else "local"
 
 
 def _search_vector(query, n_results=5, username=None, since_ts=None):
-    """向量检索（需要 Pinecone + ZHIPU_API_KEY）"""
-    if not HAS_PINECONE or not os.environ.get("PINECONE_API_KEY", "") or not os.environ.get("ZHIPU_API_KEY", ""):
+    """向量检索（Pinecone 或本地 NumPy 索引，都需要 ZHIPU_API_KEY 生成查询向量）"""
+    if not os.environ.get("ZHIPU_API_KEY", ""):
+        return []
+    backend = _resolve_vector_backend()
+    if backend == "pinecone" and (not HAS_PINECONE or not os.environ.get("PINECONE_API_KEY", "")):
+        return []
+    if backend == "local" and not HAS_NUMPY:
+        return []
+    if backend == "local" and not get_local_vector_index():
+        # 本地索引为空（还没有缓存任何 embedding）时不必为查询向量调用 API
         return []
 
     try:
-        index = get_pinecone_index()
-        embedding_client = get_embedding_client()
-        query_embedding = get_embeddings([query], client=embedding_client)[0]
+        query_embedding = get_query_embedding(query)
     except Exception:
         return []
 
+    try:
+        if backend == "local":
+            matches = _query_local(query_embedding, n_results, username, since_ts)
+        else:
+            matches = _query_pinecone(query_embedding, n_results, username, since_ts)
+    except Exception:
+        if backend == "pinecone":
+            invalidate_pinecone_index()
+        return []
+
+    # 相关性阈值：指定用户时降低阈值（已按人过滤，语义门槛可放宽）
+    SCORE_THRESHOLD = 0.3 if username else 0.55
+    tweets = []
+    for vid, score, meta, document in matches:
+        if score < SCORE_THRESHOLD:
+            continue
+        # 后置校验：防止 Pinecone filter 失效时混入其他 builder 的推文
+        if username and meta.get("username", "").lower() != username.lower():
+            continue
+        tweets.append({
+            "id": vid,
+            "document": document,
+            "metadata": meta,
+            "distance": 1.0 - score,
+        })
+
+    return tweets
+
+
+def _query_pinecone(query_embedding, n_results, username=None, since_ts=None):
+    """Pinecone 向量检索，返回 [(id, score, metadata, document)]"""
+    index = get_pinecone_index()
+
     conditions = []
     if username:
         conditions.append({"username": {"$eq": username}})
@@ -313,34 +769,134 @@ def _search_vector(query, n_results=5, username=None, since_ts=None):
     else:
         where_filter = {"$and": conditions}
 
-    try:
-        results = index.query(
-            vector=query_embedding,
-            top_k=n_results,
-            filter=where_filter,
-            include_metadata=True,
-        )
-    except Exception:
-        return []
+    results = index.query(
+        vector=query_embedding,
+        top_k=n_results,
+        filter=where_filter,
+        include_metadata=True,
+    )
 
-    # 相关性阈值：指定用户时降低阈值（已按人过滤，语义门槛可放宽）
-    SCORE_THRESHOLD = 0.3 if username else 0.55
-    tweets = []
+    # lean metadata 只有过滤字段，正文与完整 metadata 从本地存储补全；本地没有的记录无法展示，跳过
+    lean_ids = [match.id for match in results.matches if _is_lean_metadata(match.metadata)]
+    hydrated = _get_store_records(lean_ids) if lean_ids else {}
+
+    matches = []
+    dropped = 0
     for match in results.matches:
-        if match.score < SCORE_THRESHOLD:
-            continue
         meta = match.metadata or {}
-        # 后置校验：防止 Pinecone filter 失效时混入其他 builder 的推文
-        if username and meta.get("username", "").lower() != username.lower():
+        if _is_lean_metadata(meta):
+            record = hydrated.get(match.id)
+            if record is None:
+                dropped += 1
+                continue
+            matches.append((match.id, match.score, record.get("metadata", {}), record.get("document", "")))
             continue
-        tweets.append({
-            "id": match.id,
-            "document": meta.get("document") or meta.get("summary", "") or meta.get("original_text", ""),
-            "metadata": meta,
-            "distance": 1.0 - match.score,
-        })
+        document = meta.get("document") or meta.get("summary", "") or meta.get("original_text", "")
+        matches.append((match.id, match.score, meta, document))
+    if dropped:
+        print(f"Warning: {dropped} Pinecone matches have lean metadata but are missing from the local store, skipped")
+    return matches
 
-    return tweets
+
+def _query_local(query_embedding, n_results, username=None, since_ts=None):
+    """本地 NumPy 索引检索，返回 [(id, score, metadata, document)]"""
+    index = get_local_vector_index()
+    if index is None:
+        return []
+    hits = index.search(query_embedding, top_k=n_results, username=username, since_ts=since_ts)
+    records = _get_store_records([vid for vid, _ in hits])
+    matches = []
+    for vid, score in hits:
+        record = records.get(vid)
+        if record is not None:
+            matches.append((vid, score, record.get("metadata", {}), record.get("document", "")))
+    return matches
+
+
+_local_index = None
+_local_index_lock = threading.Lock()
+# 同一时间只允许一次重建（写同一个索引目录）；_local_index_rebuilding 标记后台重建是否在进行
+_local_index_build_lock = threading.Lock()
+_local_index_rebuilding = False
+
+
+def _local_index_dir():
+    return os.path.join(LOCAL_INDEX_DIR, f"{EMBEDDING_MODEL}-{EMBEDDING_DIM}")
+
+
+def get_local_vector_index(allow_api=False, wait=False):
+    """
+    获取本地向量索引（进程内缓存）
+    本地存储或 embedding 缓存有变化时在后台线程重建，重建完成前继续使用旧索引（还没有索引时返回 None）；
+    wait=True 时在当前线程重建后返回（入库后调用）。默认只使用已缓存的 embedding，
+    allow_api=True 时为缺失的文档调用智谱 API 补齐并同步重建（见 --build-local-index）
+    numpy 不可用时返回 None
+    """
+    global _local_index, _local_index_rebuilding
+    cache = get_embedding_cache(EMBEDDING_MODEL, EMBEDDING_DIM)
+    if cache is None:
+        return None
+    if allow_api or wait:
+        return _rebuild_local_vector_index(cache, allow_api)
+
+    with _local_index_lock:
+        signature = [_store_signature(), len(cache)]
+        if _local_index is None:
+            # 进程内还没有索引：先用磁盘上的（可能已过期），过期的在后台重建
+            _local_index = LocalVectorIndex.load(_local_index_dir())
+        current = _local_index
+        if (current is not None and current.signature == signature) or _local_index_rebuilding:
+            return current
+        _local_index_rebuilding = True
+
+    def _rebuild():
+        global _local_index_rebuilding
+        try:
+            _rebuild_local_vector_index(cache)
+        except Exception as e:
+            print(f"Warning: local vector index rebuild failed ({e})")
+        finally:
+            with _local_index_lock:
+                _local_index_rebuilding = False
+
+    threading.Thread(target=_rebuild, name="local-vector-index", daemon=True).start()
+    return current
+
+
+def _rebuild_local_vector_index(cache, allow_api=False):
+    """从本地存储与 embedding 缓存重建本地向量索引，完成后替换进程内缓存的索引"""
+    global _local_index
+    with _local_index_build_lock:
+        signature = [_store_signature(), len(cache)]
+        current = _local_index
+        if current is not None and current.signature == signature and not allow_api:
+            # 排队等待期间已被其他线程重建
+            return current
+
+        records = _load_store_snapshot()[0]
+        documents = [r.get("document", "") for r in records]
+        if allow_api and documents:
+            vectors = get_embeddings(documents)
+        else:
+            vectors = cache.get_many([d[:2000] for d in documents])
+
+        kept = [(r, v) for r, v in zip(records, vectors) if v is not None]
+        index = LocalVectorIndex.build(
+            _local_index_dir(),
+            ids=[r["id"] for r, _ in kept],
+            usernames=[meta_get(r, "username", "") for r, _ in kept],
+            timestamps=[meta_get(r, "unix_timestamp", 0) for r, _ in kept],
+            vectors=[v for _, v in kept],
+            dim=EMBEDDING_DIM,
+            # 签名取重建开始时的值：重建期间存储又有写入时，下次查询会再重建一次
+            # （allow_api 会往 embedding 缓存写入新向量，缓存条数取重建后的值）
+            signature=[signature[0], len(cache)],
+        )
+        with _local_index_lock:
+            _local_index = index
+        missing = len(records) - len(kept)
+        print(f"Local vector index built: {len(kept)} tweets" + (f" ({missing} without cached embedding)" if missing else ""))
+        return index
 
 
 def _extract_keywords(query):
@@ -349,8 +905,8 @@ def _extract_keywords(query):
     if not query_lower:
         return []
 
-    # 先提取中英文词块
-    tokens = re.findall(r"[\u4e00-\u9fff]{2,}|[a-z0-9_#@.-]{2,}", query_lower)
+    # 先提取中英文词块（与文档侧切词规则一致）
+    tokens = word_terms(query_lower)
 
     # 对纯中文长句补充 2-4 字子串，提升无空格中文检索召回
     cjk_only = re.sub(r"[^\u4e00-\u9fff]", "", query_lower)
@@ -372,62 +928,135 @@ def _extract_keywords(query):
     return keywords
 
 
-def _search_keyword(query, n_results=5, username=None):
-    """关键词匹配降级方案（不需要 API Key 或 Pinecone）"""
-    all_tweets = _load_json_store()
-    if not all_tweets:
-        return []
+_keyword_index = None
+_keyword_index_lock = threading.Lock()
 
-    if username:
-        all_tweets = [t for t in all_tweets if t.get("metadata", {}).get("username", "").lower() == username.lower()]
 
-    keywords = _extract_keywords(query)
+def get_keyword_index():
+    """
+    获取关键词倒排索引（进程内缓存）
+    本地存储签名与索引记录的签名不一致时（同步、迁移、整体替换后）从全部记录重建并持久化
+    """
+    global _keyword_index
+    with _keyword_index_lock:
+        signature = _store_signature()
+        if _keyword_index is not None and _keyword_index.signature == signature:
+            return _keyword_index
 
-    scored = []
-    if keywords:
-        for t in all_tweets:
-            doc = (t.get("document", "") + " " + t.get("metadata", {}).get("summary", "")).lower()
-            score = 0
-            for kw in keywords:
-                if kw in doc:
-                    # 长关键词权重更高
-                    score += 2 if len(kw) >= 4 else 1
-            if score > 0:
-                scored.append((score, t))
+        loaded = KeywordIndex.load(KEYWORD_INDEX_PATH)
+        if loaded is not None and loaded.signature == signature:
+            _keyword_index = loaded
+            return _keyword_index
 
-        scored.sort(key=lambda x: x[0], reverse=True)
+        _keyword_index = KeywordIndex.build(_load_store_snapshot()[0], signature=signature)
+        _keyword_index.save(KEYWORD_INDEX_PATH)
+        return _keyword_index
 
-    # 指定用户但关键词匹配无结果时，兜底返回该用户最近 N 条推文
-    if username and not scored:
-        def _parse_dt(t):
-            dt_str = t.get("metadata", {}).get("datetime", "")
-            for fmt in ["%Y-%m-%dT%H:%M:%S.%fZ", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%SZ", "%Y-%m-%d"]:
-                try:
-                    return datetime.strptime(dt_str[:26], fmt)
-                except ValueError:
-                    continue
-            return datetime.min
 
-        recent = sorted(all_tweets, key=_parse_dt, reverse=True)[:n_results]
-        return [
-            {"id": t.get("id", ""), "document": t.get("document", ""), "metadata": t.get("metadata", {}), "distance": 0.5}
-            for t in recent
-        ]
+def _update_keyword_index(records, previous_signature):
+    """
+    增量写入后同步更新倒排索引：索引与写入前的存储一致时直接追加，否则留待下次查询重建
+    查询线程不加锁读取 _keyword_index，因此追加在副本上进行，完成后再替换引用
+    """
+    global _keyword_index
+    with _keyword_index_lock:
+        index = _keyword_index
+        if index is not None and index.signature == previous_signature:
+            index = index.copy()
+        else:
+            index = KeywordIndex.load(KEYWORD_INDEX_PATH)
+        if index is None or index.signature != previous_signature:
+            return
+
+        index.add(records)
+        if index.needs_compaction:
+            # 覆盖写入累积的墓碑过多：丢弃索引，下次查询时重建
+            _keyword_index = None
+            try:
+                os.remove(KEYWORD_INDEX_PATH)
+            except OSError:
+                pass
+            return
+        index.signature = _store_signature()
+        index.save(KEYWORD_INDEX_PATH)
+        _keyword_index = index
+
+
+def _recent_tweet_results(username, n_results, since_ts=None):
+    """某个 builder 最近 N 条推文，整理成检索结果格式"""
+    recent = get_latest_tweets(username, n_results)
+    if since_ts:
+        recent = [t for t in recent if record_timestamp(t) >= since_ts]
+    return [
+        {"id": t.get("id", ""), "document": t.get("document", ""), "metadata": t.get("metadata", {}), "distance": 0.5}
+        for t in recent
+    ]
+
+
+def _search_keyword(query, n_results=5, username=None, since_ts=None, recent_fallback=True):
+    """
+    关键词匹配（不需要 API Key 或 Pinecone）：倒排索引 + BM25 打分
+    recent_fallback: 指定用户但没有匹配时，是否兜底返回该用户最近 N 条推文
+    """
+    index = get_keyword_index()
+    if not len(index):
+        return []
+
+    keywords = _extract_keywords(query)
+    # 按时间过滤会丢弃部分命中，多取一些候选
+    top_k = n_results * 4 if since_ts else n_results
+    hits = index.search(keywords, top_k=top_k, username=username) if keywords else []
+
+    records = _get_store_records([vid for vid, _ in hits])
+    if since_ts:
+        hits = [(vid, score) for vid, score in hits if vid in records and record_timestamp(records[vid]) >= since_ts]
+    hits = hits[:n_results]
+
+    # 指定用户但关键词匹配无结果时，兜底返回该用户最近 N 条推文
+    if username and not hits and recent_fallback:
+        return _recent_tweet_results(username, n_results, since_ts)
 
     results = []
-    for score, t in scored[:n_results]:
+    for vid, score in hits:
+        t = records.get(vid)
+        if t is None:
+            continue
         results.append({
             "id": t.get("id", ""),
             "document": t.get("document", ""),
             "metadata": t.get("metadata", {}),
-            "distance": 1.0 - (score / max(len(keywords), 1)),
+            # BM25 分数无上界，映射到 (0, 1) 的距离，分数越高距离越小
+            "distance": 1.0 / (1.0 + score),
         })
 
     return results
 
 
+def _store_signature():
+    """本地存储的变更签名（文件大小与修改时间），用于判断派生索引是否过期"""
+    if _use_sqlite():
+        paths = [tweet_store.TWEETS_DB_PATH, tweet_store.TWEETS_DB_PATH + "-wal"]
+    else:
+        paths = [TWEETS_JSON_PATH]
+    signature = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            signature.append([st.st_size, st.st_mtime_ns])
+        except OSError:
+            signature.append(None)
+    return signature
+
+
+def _use_sqlite(json_path=None):
+    """未显式指定 JSON 路径且后端配置为 sqlite 时使用 SQLite 存储"""
+    return json_path is None and TWEETS_STORE_BACKEND == "sqlite"
+
+
 def _load_json_store(json_path=None):
-    """从 JSON 文件加载推文数据"""
+    """加载全部推文数据（按 TWEETS_STORE_BACKEND 选择 JSON 文件或 SQLite）"""
+    if _use_sqlite(json_path):
+        return tweet_store.load_all()
     path = json_path or TWEETS_JSON_PATH
     if not os.path.exists(path):
         return []
@@ -435,42 +1064,346 @@ def _load_json_store(json_path=None):
         return json.load(f)
 
 
+_store_version = 0
+_store_snapshot = None
+_store_snapshot_lock = threading.Lock()
+
+
+def _load_store_snapshot():
+    """
+    本地存储的进程内只读快照，返回 (records 元组, {id: record} 只读映射)
+    仅在存储签名（文件大小/修改时间）或本进程写入版本变化时重新加载；
+    并发请求共享同一份快照。记录为 CompactRecord（兼容 dict 式读取，需要 dict 时用 to_dict）
+    """
+    global _store_snapshot
+    key = [_store_version, _store_signature()]
+    snapshot = _store_snapshot
+    if snapshot is not None and snapshot[0] == key:
+        return snapshot[1], snapshot[2]
+
+    with _store_snapshot_lock:
+        snapshot = _store_snapshot
+        if snapshot is None or snapshot[0] != key:
+            records = tuple(compact(r) for r in _load_json_store())
+            by_id = MappingProxyType({str(r.get("id", "")): r for r in records})
+            snapshot = _store_snapshot = (key, records, by_id)
+        return snapshot[1], snapshot[2]
+
+
+def _invalidate_store_snapshot(records=None):
+    """本进程写入存储后调用：版本号递增；传入写入后的全部记录时直接作为新快照，省去重新解析"""
+    global _store_version, _store_snapshot
+    with _store_snapshot_lock:
+        _store_version += 1
+        if records is None:
+            _store_snapshot = None
+            return
+        records = tuple(compact(r) for r in records)
+        by_id = MappingProxyType({str(r.get("id", "")): r for r in records})
+        _store_snapshot = ([_store_version, _store_signature()], records, by_id)
+
+
 def _save_json_store(tweets, json_path=None):
-    """保存推文数据到 JSON 文件"""
+    """整体替换推文数据（按 TWEETS_STORE_BACKEND 选择 JSON 文件或 SQLite）"""
+    if _use_sqlite(json_path):
+        tweet_store.replace_all(tweets)
+        _invalidate_store_snapshot(tweets)
+        return
     path = json_path or TWEETS_JSON_PATH
     os.makedirs(os.path.dirname(path), exist_ok=True)
     with open(path, "w", encoding="utf-8") as f:
-        json.dump(tweets, f, ensure_ascii=False, indent=2)
+        # 快照里的 CompactRecord 序列化时还原为 dict
+        json.dump(tweets, f, ensure_ascii=False, indent=2, default=to_dict)
+    if path == TWEETS_JSON_PATH and not _use_sqlite():
+        _invalidate_store_snapshot(tweets)
+
+
+def _upsert_store_records(records, previous=None):
+    """
+    增量写入记录（同 ID 覆盖）。SQLite 只写新增行，JSON 仍需整文件重写。
+    关键词倒排索引与统计汇总随之增量更新。返回写入后的总条数
+    previous: 调用方已查询过的被覆盖旧记录 {id: record}（不含新增 ID），传入时不再查询
+    """
+    previous_signature = _store_signature()
+    if previous is None:
+        previous = _get_store_records([r["id"] for r in records])
+    if _use_sqlite():
+        tweet_store.upsert(records)
+        _invalidate_store_snapshot()
+        _update_keyword_index(records, previous_signature)
+        _update_stats_rollup(records, previous, previous_signature)
+        return tweet_store.count()
+    tweets = list(_load_store_snapshot()[0])
+    index = {t["id"]: i for i, t in enumerate(tweets)}
+    for r in records:
+        if r["id"] in index:
+            tweets[index[r["id"]]] = r
+        else:
+            index[r["id"]] = len(tweets)
+            tweets.append(r)
+    _save_json_store(tweets)
+    _update_keyword_index(records, previous_signature)
+    _update_stats_rollup(records, previous, previous_signature)
+    return len(tweets)
+
+
+def _delete_store_records(ids):
+    """
+    按 ID 删除本地记录（远端已删除的推文）。删除很少发生：
+    关键词索引、统计汇总等派生索引不做增量处理，存储签名变化后下次查询时重建
+    """
+    ids = {str(i) for i in ids}
+    if _use_sqlite():
+        tweet_store.delete(ids)
+        _invalidate_store_snapshot()
+        return
+    _save_json_store([t for t in _load_store_snapshot()[0] if t["id"] not in ids])
+
+
+def _get_store_records(ids):
+    """按 ID 查询本地存储，返回 {id: record}"""
+    wanted = {str(i) for i in ids if i}
+    if _use_sqlite():
+        return tweet_store.get_by_ids(wanted)
+    by_id = _load_store_snapshot()[1]
+    return {i: by_id[i] for i in wanted if i in by_id}
+
+
+def _store_count():
+    """本地存储的推文条数"""
+    if _use_sqlite():
+        return tweet_store.count()
+    return len(_load_store_snapshot()[0])
+
+
+def repopulate_pinecone(allow_api=False):
+    """
+    用本地存储 + 本地 embedding 缓存重新填充 Pinecone（重建索引、更换索引名后使用）
+    缓存未命中的推文默认跳过；allow_api=True 时调用智谱 API 补齐
+    返回写入 Pinecone 的条数
+    """
+    cache = get_embedding_cache(EMBEDDING_MODEL, EMBEDDING_DIM)
+    if cache is None:
+        raise ImportError("numpy 未安装，无法读取本地 embedding 缓存")
+
+    records = _load_store_snapshot()[0]
+    index = get_pinecone_index()
+    client = get_embedding_client() if allow_api else None
+
+    upserted = 0
+    skipped = 0
+    batch_size = 20
+    for i in range(0, len(records), batch_size):
+        batch = records[i:i + batch_size]
+        docs = [r["document"] for r in batch]
+        if allow_api:
+            embeddings = get_embeddings(docs, client=client)
+        else:
+            embeddings = cache.get_many([d[:2000] for d in docs])
+        vectors = [
+            {"id": r["id"], "values": emb, "metadata": _pinecone_metadata(r)}
+            for r, emb in zip(batch, embeddings) if emb is not None
+        ]
+        skipped += len(batch) - len(vectors)
+        if vectors:
+            index.upsert(vectors=vectors)
+            upserted += len(vectors)
+
+    print(f"Repopulated Pinecone with {upserted} vectors from local cache ({skipped} skipped: not cached)")
+    return upserted
+
+
+def migrate_pinecone_metadata():
+    """
+    按当前 PINECONE_METADATA_MODE 重写 Pinecone 中已有向量的 metadata（向量值不变）
+    Pinecone 的 update 只能增改字段、不能删除字段，因此 fetch 出向量值后整条重新 upsert；
+    lean 模式下本地存储没有的记录会被跳过，避免丢失正文
+    返回重写的条数
+    """
+    index = get_pinecone_index()
+    by_id = _load_store_snapshot()[1]
+
+    def _rewrite(batch_ids):
+        result = index.fetch(ids=batch_ids)
+        vectors = []
+        skipped = 0
+        for vid, vec in result.vectors.items():
+            record = by_id.get(vid)
+            if record is None:
+                skipped += 1
+                continue
+            vectors.append({"id": vid, "values": list(vec.values), "metadata": _pinecone_metadata(record)})
+        for chunk in _pack_upsert_batches(vectors):
+            index.upsert(vectors=chunk)
+        return len(vectors), skipped
+
+    rewritten = 0
+    skipped = 0
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=PINECONE_UPSERT_CONCURRENCY) as pool:
+        futures = []
+        for ids_page in index.list():
+            ids_page = list(ids_page)
+            # fetch 会带回 2048 维向量值，按 100 条一批控制响应体积
+            for i in range(0, len(ids_page), 100):
+                futures.append(pool.submit(_rewrite, ids_page[i:i + 100]))
+        for future in futures:
+            done, missing = future.result()
+            rewritten += done
+            skipped += missing
+
+    elapsed = max(time.monotonic() - started, 1e-6)
+    print(f"Rewrote Pinecone metadata ({PINECONE_METADATA_MODE}) for {rewritten} vectors in {elapsed:.1f}s "
+          f"({skipped} skipped: not in local store)")
+    return rewritten
+
+
+def migrate_store(target):
+    """
+    一次性迁移本地存储
+    target="sqlite": data/tweets_store.json -> data/tweets_store.sqlite
+    target="json":   data/tweets_store.sqlite -> data/tweets_store.json
+    返回迁移条数；迁移完成后需把 TWEETS_STORE_BACKEND 设为 target
+    """
+    if target == "sqlite":
+        tweets = _load_json_store(TWEETS_JSON_PATH)
+        tweet_store.replace_all(tweets)
+    elif target == "json":
+        tweets = tweet_store.load_all()
+        _save_json_store(tweets, TWEETS_JSON_PATH)
+    else:
+        raise ValueError(f"未知的存储后端: {target}（可选 sqlite / json）")
+    print(f"Migrated {len(tweets)} tweets to {target} store")
+    return len(tweets)
+
+
+_time_index = None
+
+
+def _load_time_index():
+    """当前存储快照的时间索引；快照更新后重建一次（发布时间只在此时解析）"""
+    global _time_index
+    records = _load_store_snapshot()[0]
+    index = _time_index
+    if index is None or index.records is not records:
+        index = _time_index = TimeIndex(records)
+    return index
+
+
+def get_latest_tweets(username, n=20):
+    """某个 builder 最新的 n 条推文（按发布时间降序）"""
+    return _load_time_index().latest(username, n)
 
 
 def get_all_tweets_metadata(db_path=None, days=None):
     """
     获取所有推文的元数据（用于趋势分析）
-    从 JSON 文件读取（Pinecone 不支持全量扫描）
-    days: 可选，只返回最近 N 天内的推文
+    从本地存储的进程内快照读取（Pinecone 不支持全量扫描），返回结果不可修改
+    days: 可选，只返回最近 N 天内的推文（时间索引上二分定位；无法解析时间的推文保留）
+    """
+    if not days:
+        return _load_store_snapshot()[0]
+    return _load_time_index().since(int(time.time()) - days * 86400)
+
+
+_stats_rollup = None
+_stats_rollup_lock = threading.Lock()
+
+
+def get_stats_rollup():
+    """
+    获取 builder × 日期统计汇总（进程内缓存）
+    本地存储签名与汇总记录的签名不一致时从全部记录重建并持久化
     """
-    tweets = _load_json_store()
-    return _filter_tweets_by_days(tweets, days=days)
+    global _stats_rollup
+    with _stats_rollup_lock:
+        signature = _store_signature()
+        if _stats_rollup is not None and _stats_rollup.signature == signature:
+            return _stats_rollup
+
+        loaded = StatsRollup.load(STATS_ROLLUP_PATH)
+        if loaded is not None and loaded.signature == signature:
+            _stats_rollup = loaded
+            return _stats_rollup
+
+        _stats_rollup = StatsRollup.build(_load_store_snapshot()[0], signature=signature)
+        _stats_rollup.save(STATS_ROLLUP_PATH)
+        return _stats_rollup
+
+
+def _update_stats_rollup(records, previous, previous_signature):
+    """
+    增量写入后同步更新统计汇总：覆盖写入的记录先撤销旧值再计入新值
+    汇总与写入前的存储不一致时不做处理，留待下次查询重建
+    stats() 不加锁读取 _stats_rollup，因此在副本上更新，完成后再替换引用
+    """
+    global _stats_rollup
+    with _stats_rollup_lock:
+        rollup = _stats_rollup
+        if rollup is not None and rollup.signature == previous_signature:
+            rollup = rollup.copy()
+        else:
+            rollup = StatsRollup.load(STATS_ROLLUP_PATH)
+        if rollup is None or rollup.signature != previous_signature:
+            return
+
+        current = dict(previous)
+        for r in records:
+            old = current.get(r["id"])
+            if old is not None:
+                rollup.add(old, delta=-1)
+            rollup.add(r)
+            current[r["id"]] = r
+        rollup.signature = _store_signature()
+        rollup.save(STATS_ROLLUP_PATH)
+        _stats_rollup = rollup
 
 
 def get_all_tweets_stats(days=None):
-    """获取推文统计（不依赖 Pinecone）"""
-    tweets = get_all_tweets_metadata(days=days)
-    builder_counts = {}
-    for t in tweets:
-        username = t.get("metadata", {}).get("username", "unknown")
-        builder_counts[username] = builder_counts.get(username, 0) + 1
-    return {
-        "total_tweets": len(tweets),
-        "builder_counts": builder_counts,
-    }
+    """
+    获取推文统计（不依赖 Pinecone），由 builder × 日期汇总计算，耗时与天数成正比
+    days: 可选，与 get_all_tweets_metadata 相同的最近 N×24 小时窗口；返回值附带按日期升序的 daily 序列
+    窗口起点所在日只有部分在窗口内，这一天的条数从时间索引按时间范围统计
+    """
+    if not days:
+        return get_stats_rollup().stats()
+    now = int(time.time())
+    since_ts = now - days * 86400
+    next_day = since_ts - since_ts % 86400 + 86400
+    edge_counts = {}
+    for r in _load_time_index().between(since_ts, next_day):
+        username = meta_get(r, "username", "unknown")
+        edge_counts[username] = edge_counts.get(username, 0) + 1
+    return get_stats_rollup().stats(days=days, now=now, edge_counts=edge_counts)
 
 
 if __name__ == "__main__":
-    import sys
     if len(sys.argv) < 2:
         print("Usage: python rag_store.py <summarized_tweets.json>")
+        print("       python rag_store.py --migrate-to-sqlite | --migrate-to-json")
+        print("       python rag_store.py --repopulate-pinecone [--allow-api]")
+        print("       python rag_store.py --build-local-index")
+        print("       python rag_store.py --migrate-pinecone-metadata")
         sys.exit(1)
 
+    if sys.argv[1] == "--build-local-index":
+        get_local_vector_index(allow_api=True)
+        print_metrics_summary()
+        sys.exit(0)
+
+    if sys.argv[1] == "--repopulate-pinecone":
+        repopulate_pinecone(allow_api="--allow-api" in sys.argv[2:])
+        print_metrics_summary()
+        sys.exit(0)
+
+    if sys.argv[1] == "--migrate-pinecone-metadata":
+        migrate_pinecone_metadata()
+        sys.exit(0)
+
+    if sys.argv[1] in ("--migrate-to-sqlite", "--migrate-to-json"):
+        migrate_store(sys.argv[1].rsplit("-", 1)[-1])
+        sys.exit(0)
+
     count = ingest_tweets(sys.argv[1])
     print(f"Ingested {count} tweets into Pinecone.")
+    print_metrics_summary()
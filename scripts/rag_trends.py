@@ -5,8 +5,10 @@
 
 import os
 from datetime import timedelta
-from openai import OpenAI
-from scripts.rag_store import get_all_tweets_metadata, search_tweets, _load_json_store
+from scripts.compact_record import meta_get
+from scripts.llm_client import get_client
+from scripts.resilience import call_with_retry
+from scripts.rag_store import get_all_tweets_metadata, get_latest_tweets, search_tweets
 
 
 TRENDS_SYSTEM_PROMPT = """你是一个 AI 技术趋势分析师，必须严格基于给定推文证据输出结论。
@@ -51,19 +53,16 @@ def _check_api_key():
 
 
 def _get_llm_client():
-    """获取 LLM 客户端"""
+    """获取 LLM 客户端（共享连接池）"""
     api_key = _check_api_key()
-    return OpenAI(
-        api_key=api_key,
-        base_url="https://open.bigmodel.cn/api/paas/v4",
-        timeout=25.0,
-    )
+    return get_client("trends", api_key=api_key)
 
 
 def _call_llm(system_prompt, user_prompt):
     """调用 LLM"""
     client = _get_llm_client()
-    response = client.chat.completions.create(
+    # 接口超时接近请求总时限，只尝试一次；熔断时快速失败
+    response = call_with_retry("trends", lambda: client.chat.completions.create(
         model="glm-4.7",
         messages=[
             {"role": "system", "content": system_prompt},
@@ -72,7 +71,7 @@ def _call_llm(system_prompt, user_prompt):
         temperature=0.5,
         max_tokens=2000,
         extra_body={"thinking": {"type": "disabled"}},
-    )
+    ), max_attempts=1)
     return response.choices[0].message.content.strip()
 
 
@@ -120,7 +119,7 @@ def analyze_trends(db_path=None, days=None):
         return {"analysis": "暂无推文数据，请先运行抓取流程导入推文。", "tweet_count": 0}
 
     # 时间范围内的 builder 列表
-    builders = list({t.get("metadata", {}).get("username", "") for t in all_tweets if t.get("metadata", {}).get("username")})
+    builders = list({meta_get(t, "username") for t in all_tweets if meta_get(t, "username")})
 
     # per_builder 根据时间范围内实际数据动态计算：总条数 / builder 数，上限20条
     per_builder = max(5, min(20, len(all_tweets) // len(builders))) if builders else 10
@@ -130,7 +129,7 @@ def analyze_trends(db_path=None, days=None):
 
     # 向量搜索无结果时降级为取本地最新120条
     if not sampled:
-        sampled = sorted(all_tweets, key=lambda t: t.get("metadata", {}).get("datetime", ""), reverse=True)[:120]
+        sampled = sorted(all_tweets, key=lambda t: meta_get(t, "datetime", ""), reverse=True)[:120]
 
     # 构建推文摘要文本（限制总长度）
     tweets_text_parts = []
@@ -171,10 +170,9 @@ def analyze_builder(username, db_path=None):
         db_path=db_path,
     )
 
-    # 如果向量检索和关键词搜索都没结果，直接从 JSON 按用户名过滤
+    # 如果向量检索和关键词搜索都没结果，直接取该用户最新的 20 条推文
     if not results:
-        all_tweets = get_all_tweets_metadata(db_path=db_path)
-        results = [t for t in all_tweets if t.get("metadata", {}).get("username") == username][:20]
+        results = get_latest_tweets(username, 20)
 
     if not results:
         return {
@@ -0,0 +1,196 @@
+"""
+智谱 API 调用容错模块
+按错误类型分类重试（429 / 5xx / 超时 / 连接错误），带抖动的指数退避，
+按接口熔断，避免持续请求一个已经失败的接口；并统计每次运行的调用指标
+"""
+
+import os
+import time
+import random
+import threading
+
+import openai
+
+
+RETRY_MAX_ATTEMPTS = int(os.environ.get("ZHIPU_RETRY_MAX_ATTEMPTS", "4"))
+RETRY_BASE_DELAY = float(os.environ.get("ZHIPU_RETRY_BASE_DELAY", "1"))
+RETRY_MAX_DELAY = float(os.environ.get("ZHIPU_RETRY_MAX_DELAY", "20"))
+
+# 连续失败达到阈值后熔断，冷却期内直接失败，冷却结束后放行一次试探请求
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("ZHIPU_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN_SECONDS = float(os.environ.get("ZHIPU_BREAKER_COOLDOWN", "30"))
+
+
+class CircuitOpenError(Exception):
+    """接口处于熔断状态，请求未发出"""
+
+
+def is_retryable(error):
+    """429、5xx、超时和连接错误可以重试；4xx 参数/鉴权错误重试也不会成功"""
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+def _retry_after(error):
+    """读取服务端返回的 Retry-After（秒），没有则返回 None"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY):
+    """第 attempt 次重试前的等待时间（full jitter 指数退避）"""
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+
+
+class CircuitBreaker:
+    """单个接口的熔断器（线程安全）"""
+
+    def __init__(self, threshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN_SECONDS):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.cooldown or self._probing:
+                return False
+            # 冷却结束：半开状态，只放行一个试探请求
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        """记录一次失败，返回熔断器是否因此打开"""
+        with self._lock:
+            self._failures += 1
+            if self._probing or (self._opened_at is None and self._failures >= self.threshold):
+                self._opened_at = time.monotonic()
+                self._probing = False
+                return True
+            return False
+
+
+class CallMetrics:
+    """按接口统计的调用指标"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _endpoint(self, endpoint):
+        return self._stats.setdefault(endpoint, {
+            "calls": 0, "attempts": 0, "retries": 0, "failures": 0,
+            "rejected": 0, "latencies": [],
+        })
+
+    def record(self, endpoint, **counts):
+        with self._lock:
+            stats = self._endpoint(endpoint)
+            for key, value in counts.items():
+                stats[key] += value
+
+    def record_latency(self, endpoint, seconds):
+        with self._lock:
+            self._endpoint(endpoint)["latencies"].append(seconds)
+
+    def summary(self):
+        with self._lock:
+            result = {}
+            for endpoint, stats in self._stats.items():
+                latencies = sorted(stats["latencies"])
+                item = {k: v for k, v in stats.items() if k != "latencies"}
+                if latencies:
+                    item["latency_p50_ms"] = round(latencies[len(latencies) // 2] * 1000)
+                    item["latency_p95_ms"] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000)
+                    item["latency_max_ms"] = round(latencies[-1] * 1000)
+                result[endpoint] = item
+            return result
+
+
+metrics = CallMetrics()
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(endpoint):
+    with _breakers_lock:
+        if endpoint not in _breakers:
+            _breakers[endpoint] = CircuitBreaker()
+        return _breakers[endpoint]
+
+
+def call_with_retry(endpoint, fn, max_attempts=None):
+    """
+    调用 fn()，可重试错误按抖动指数退避重试
+    endpoint: 接口名（summary / embedding / qa / trends），决定使用哪个熔断器与指标分组
+    熔断打开时抛出 CircuitOpenError；重试耗尽后抛出最后一次的异常
+    """
+    max_attempts = max(1, max_attempts or RETRY_MAX_ATTEMPTS)
+    breaker = get_breaker(endpoint)
+    metrics.record(endpoint, calls=1)
+
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            metrics.record(endpoint, rejected=1, failures=1)
+            raise CircuitOpenError(f"{endpoint} 接口已熔断，{breaker.cooldown:.0f} 秒内暂停请求")
+
+        attempt += 1
+        metrics.record(endpoint, attempts=1)
+        started = time.monotonic()
+        try:
+            result = fn()
+        except Exception as e:
+            metrics.record_latency(endpoint, time.monotonic() - started)
+            retryable = is_retryable(e)
+            # 只有服务端/网络类错误计入熔断，参数错误说明接口本身是好的
+            if not retryable:
+                breaker.record_success()
+            elif breaker.record_failure():
+                print(f"Circuit breaker opened for {endpoint} after repeated failures")
+            if not retryable or attempt >= max_attempts:
+                metrics.record(endpoint, failures=1)
+                raise
+            delay = _retry_after(e) or backoff_delay(attempt)
+            metrics.record(endpoint, retries=1)
+            print(f"{endpoint} call failed ({type(e).__name__}), retry {attempt}/{max_attempts - 1} in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+
+        metrics.record_latency(endpoint, time.monotonic() - started)
+        breaker.record_success()
+        return result
+
+
+def print_metrics_summary():
+    """打印本次运行的调用指标"""
+    summary = metrics.summary()
+    if not summary:
+        return
+    print("Zhipu API metrics:")
+    for endpoint, stats in sorted(summary.items()):
+        line = (f"  {endpoint}: {stats['calls']} calls, {stats['attempts']} attempts, "
+                f"{stats['retries']} retries, {stats['failures']} failures")
+        if stats["rejected"]:
+            line += f" ({stats['rejected']} rejected by circuit breaker)"
+        if "latency_p50_ms" in stats:
+            line += (f", latency p50 {stats['latency_p50_ms']} ms / p95 {stats['latency_p95_ms']} ms"
+                     f" / max {stats['latency_max_ms']} ms")
+        print(line)
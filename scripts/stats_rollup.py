@@ -0,0 +1,108 @@
+"""
+推文统计汇总模块
+按 builder × 日期（UTC）预先汇总推文条数，入库/同步时增量更新，
+/api/rag/stats 按天数窗口查询时只遍历窗口内的日期，不再扫描全部推文。
+天数窗口与 get_all_tweets_metadata 一致，为截至当前的滚动 N×24 小时：
+窗口起点所在的那一天只有部分落在窗口内，该天的条数由调用方按时间索引单独统计后传入
+"""
+
+import os
+import json
+import time
+
+from scripts.compact_record import meta_get
+from scripts.time_index import record_timestamp
+
+
+STATS_ROLLUP_PATH = os.environ.get(
+    "STATS_ROLLUP_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "stats_rollup.json"),
+)
+
+_DAY_SECONDS = 86400
+
+
+def day_key(ts):
+    """Unix 时间戳对应的 UTC 日期（YYYY-MM-DD）"""
+    return time.strftime("%Y-%m-%d", time.gmtime(ts))
+
+
+class StatsRollup:
+    """builder × 日期的推文条数；无法解析时间的推文单独计数"""
+
+    def __init__(self, daily=None, undated=None, signature=None):
+        self.daily = daily or {}
+        self.undated = undated or {}
+        self.signature = signature
+
+    def copy(self):
+        """独立副本：增量更新在副本上进行，查询线程仍可无锁读取原汇总"""
+        daily = {date: dict(counts) for date, counts in self.daily.items()}
+        return StatsRollup(daily=daily, undated=dict(self.undated), signature=self.signature)
+
+    def add(self, record, delta=1):
+        """计入一条记录；delta=-1 时撤销（覆盖写入前先撤销旧记录）"""
+        username = meta_get(record, "username", "unknown")
+        ts = record_timestamp(record)
+        counts = self.daily.setdefault(day_key(ts), {}) if ts else self.undated
+        counts[username] = counts.get(username, 0) + delta
+        if counts[username] <= 0:
+            del counts[username]
+
+    def stats(self, days=None, now=None, edge_counts=None):
+        """
+        汇总最近 days×24 小时（None 表示全部）的统计，耗时与天数成正比
+        窗口覆盖 days+1 个 UTC 日期：中间与最后一天整天计入，第一天（窗口起点所在日）
+        只计入起点之后的部分，其各 builder 条数由 edge_counts 给出（None 时按整天计）
+        返回总条数、各 builder 条数，以及按日期升序的每日序列（总数与各 builder 条数）
+        无法解析时间的推文计入总数与 builder 条数，不进入每日序列
+        """
+        if days:
+            now = int(now if now is not None else time.time())
+            dates = [day_key(now - i * _DAY_SECONDS) for i in range(days, -1, -1)]
+        else:
+            dates = sorted(self.daily)
+
+        builder_counts = dict(self.undated)
+        daily = []
+        for i, date in enumerate(dates):
+            counts = self.daily.get(date, {})
+            if days and i == 0 and edge_counts is not None:
+                counts = edge_counts
+            for username, n in counts.items():
+                builder_counts[username] = builder_counts.get(username, 0) + n
+            daily.append({"date": date, "count": sum(counts.values()), "builders": dict(counts)})
+
+        return {
+            "total_tweets": sum(builder_counts.values()),
+            "builder_counts": builder_counts,
+            "daily": daily,
+        }
+
+    def save(self, path=None):
+        """原子写入 JSON 文件"""
+        path = path or STATS_ROLLUP_PATH
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"daily": self.daily, "undated": self.undated, "signature": self.signature}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=None):
+        """加载汇总；文件不存在或损坏时返回 None"""
+        path = path or STATS_ROLLUP_PATH
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return cls(daily=data.get("daily"), undated=data.get("undated"), signature=data.get("signature"))
+
+    @classmethod
+    def build(cls, records, signature=None):
+        """从全部记录构建汇总"""
+        rollup = cls(signature=signature)
+        for r in records:
+            rollup.add(r)
+        return rollup
@@ -4,10 +4,69 @@ AI Summary Module
 """
 
 import os
+import sys
 import json
+import re
+import hashlib
 import time
-from openai import OpenAI
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+# 以 python scripts/summarize.py 方式运行时，确保项目根目录在 Python 路径中
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from scripts.llm_client import get_client
+from scripts.resilience import CircuitOpenError, call_with_retry, print_metrics_summary
+from scripts.summary_cache import get_summary_cache, summary_cache_key
+
+
+# 并发与限速配置（可通过环境变量覆盖）
+# SUMMARY_MAX_IN_FLIGHT: 同时在途的 LLM 请求数上限
+# SUMMARY_RPS: 每秒请求数上限
+# SUMMARY_TPM: 每分钟 token 数上限（0 表示不限制）
+SUMMARY_MAX_IN_FLIGHT = int(os.environ.get("SUMMARY_MAX_IN_FLIGHT", "4"))
+SUMMARY_RPS = float(os.environ.get("SUMMARY_RPS", "2"))
+SUMMARY_TPM = int(os.environ.get("SUMMARY_TPM", "0"))
+
+# 已入库推文的处理方式（SUMMARY_STORED_MODE）：
+# reuse - 复用库中已有摘要，不调用 LLM（默认，邮件仍包含这些推文）
+# drop  - 直接丢弃已入库推文
+# off   - 不做预过滤，全部重新生成
+SUMMARY_STORED_MODE = os.environ.get("SUMMARY_STORED_MODE", "reuse")
+
+# 批量摘要（SUMMARY_BATCH_SIZE > 1 时启用）：一次请求最多打包的推文条数，
+# 以及单个批次的输入 token 预算
+SUMMARY_BATCH_SIZE = int(os.environ.get("SUMMARY_BATCH_SIZE", "1"))
+SUMMARY_BATCH_TOKEN_BUDGET = int(os.environ.get("SUMMARY_BATCH_TOKEN_BUDGET", "6000"))
+
+# 本地预判：去掉链接、@提及和表情后几乎不剩内容（不足 2 个词，或有效字符数低于该值，中文按 3 个字符计）
+# 的推文不调用 LLM，直接输出 INSUFFICIENT_SUMMARY；设为 0 关闭。
+# 阈值刻意放低：「GPT-5 is out」这类简短发布推文必须交给 LLM
+SUMMARY_TRIAGE_MIN_CHARS = int(os.environ.get("SUMMARY_TRIAGE_MIN_CHARS", "8"))
+
+# 是否把同一 builder 的自回复推文串（thread）合并为一条再概括（SUMMARY_GROUP_THREADS=0 关闭）
+SUMMARY_GROUP_THREADS = os.environ.get("SUMMARY_GROUP_THREADS", "1") != "0"
+
+# 流式模式下每次从输入文件读取并处理的推文条数
+SUMMARY_STREAM_CHUNK = int(os.environ.get("SUMMARY_STREAM_CHUNK", "100"))
+
+# 单次摘要预计输出 token 数，用于 TPM 限速估算
+SUMMARY_EXPECTED_OUTPUT_TOKENS = 200
+
+
+# 与 Prompt 中约定的"信息不足"回复保持一致
+INSUFFICIENT_SUMMARY = "信息不足，请查看推文原文"
+
+# 摘要生成失败时的占位文本前缀
+SUMMARY_FAILED_PREFIX = "（摘要生成失败"
+
+URL_PATTERN = re.compile(r"https?://\S+")
+MENTION_PATTERN = re.compile(r"@\w+")
+EMOJI_PATTERN = re.compile(
+    "[\U0001F000-\U0001FAFF\u2600-\u27BF\u2B00-\u2BFF\uFE0F\u200D]"
+)
+
+SUMMARY_SYSTEM_PROMPT = "你是一个专业的AI技术推文分析师，擅长用简洁的语言概括推文要点。"
 
 # 默认Prompt模板
 SUMMARY_PROMPT = """请用2-4句话概括以下推文，重点突出、涵盖全文。像和伙伴交流一样自然叙述。
@@ -24,6 +83,39 @@ SUMMARY_PROMPT = """请用2-4句话概括以下推文，重点突出、涵盖全
 
 概括："""
 
+# 转发/引用评论的Prompt模板：原推已单独概括过，只需把 builder 的评论叠加上去
+SUMMARY_COMMENT_PROMPT = """下面是一条转发或引用推文，包含 builder 自己的评论，以及被转发原推的概括。请用2-4句话概括，先说 builder 的观点或补充，再自然带出原推要点。像和伙伴交流一样自然叙述。
+
+要求：
+1. 只描述评论和原推概括中明确提到的信息，不要臆想任何背景、解释或推测
+2. 避免"该推文"、"作者""摘要"等词语
+3. 不要用数字分点，保持自然叙述
+
+builder 的评论：
+{comment}
+
+原推概括：
+{original_summary}
+
+概括："""
+
+# 批量Prompt模板：一次请求概括多条推文，要求输出以推文 ID 为键的 JSON 数组
+SUMMARY_BATCH_PROMPT = """请分别用2-4句话概括以下每条推文，重点突出、涵盖全文。像和伙伴交流一样自然叙述。
+
+要求：
+1. 只描述推文中明确提到的信息，必要时对文中的专有名词进行解释，不要臆想任何背景、解释或推测
+2. 如果某条推文信息不足（如只有链接、只有图片、无实质内容），该条的概括直接写"信息不足，请查看推文原文"
+3. 避免"该推文"、"作者""摘要"等词语
+4. 不要用数字分点，保持自然叙述
+5. 不要逐字翻译，而是抓住重点，发生了什么，为什么重要
+6. 每条推文独立概括，不要混入其他推文的内容
+
+只输出一个 JSON 数组，不要输出任何其他内容。数组共 {count} 个元素，每个元素形如：
+{{"id": "推文ID", "summary": "概括"}}
+
+推文列表：
+{tweets_block}"""
+
 
 def extract_full_text(tweet):
     """提取完整的推文内容，包括转发和引用"""
@@ -50,111 +142,745 @@ def extract_full_text(tweet):
     return text.strip()
 
 
-def generate_summary(tweet_text, api_key, model='glm-4.7'):
-    """生成单条推文的摘要"""
+class TokenBucket:
+    """线程安全的令牌桶：每秒补充 rate 个令牌，最多积攒 capacity 个"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """取出 amount 个令牌，不足时阻塞等待"""
+        # 单次请求超过桶容量时按满桶处理，避免永远等不到
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait = (amount - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """组合限速器：同时限制每秒请求数与每分钟 token 数"""
+
+    def __init__(self, requests_per_second=SUMMARY_RPS, tokens_per_minute=SUMMARY_TPM):
+        self.request_bucket = None
+        self.token_bucket = None
+        if requests_per_second and requests_per_second > 0:
+            self.request_bucket = TokenBucket(requests_per_second, max(1.0, requests_per_second))
+        if tokens_per_minute and tokens_per_minute > 0:
+            self.token_bucket = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute)
+
+    def acquire(self, tokens=0):
+        if self.request_bucket:
+            self.request_bucket.acquire(1)
+        if self.token_bucket and tokens:
+            self.token_bucket.acquire(tokens)
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：中文约 1 字 1 token，其余约 4 字符 1 token"""
+    cjk = len(re.findall(r"[\u4e00-\u9fff]", text))
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+def is_content_free(text, min_chars=SUMMARY_TRIAGE_MIN_CHARS):
+    """
+    本地判断推文是否无实质内容（只有链接、图片、表情或一句简短回应）
+    基于 extract_full_text 的输出，转发/引用原文也计入有效内容
+    """
+    if not text or min_chars <= 0:
+        return False
+
+    urls = URL_PATTERN.findall(text)
+    rest = MENTION_PATTERN.sub(" ", URL_PATTERN.sub(" ", text))
+    emoji_count = len(EMOJI_PATTERN.findall(rest))
+    rest = EMOJI_PATTERN.sub("", rest)
+
+    cjk = len(re.findall(r"[\u4e00-\u9fff]", rest))
+    words = re.findall(r"[A-Za-z0-9]{2,}", rest)
+    informative = cjk * 3 + sum(len(w) for w in words)
+    # 词数：英文/数字按词计（含「4」这类单字符版本号），中文约 2 字一词
+    word_count = len(re.findall(r"[A-Za-z0-9]+", rest)) + cjk // 2
+    if word_count < 2 or informative < min_chars:
+        return True
+
+    # 链接和表情占了绝大部分篇幅，剩余文字也不多
+    noise = sum(len(u) for u in urls) + emoji_count
+    return noise / len(text) > 0.8 and informative < min_chars * 2
+
+
+def generate_summary(tweet_text, api_key, model='glm-4.7', rate_limiter=None, cache=None):
+    """
+    生成单条推文的摘要
+    rate_limiter: 可选，调用 LLM 前先从限速器取令牌
+    cache: 摘要缓存，默认使用 get_summary_cache()；命中时不调用 LLM
+    """
     if not tweet_text or not tweet_text.strip():
         return "（空推文）"
 
-    client = OpenAI(
-        api_key=api_key,
-        base_url="https://open.bigmodel.cn/api/paas/v4"
-    )
-
     prompt = SUMMARY_PROMPT.format(tweet_text=tweet_text)
+    return _cached_summary(prompt, tweet_text, SUMMARY_PROMPT, api_key, model, rate_limiter, cache)
+
+
+def generate_comment_summary(comment, original_summary, api_key, model='glm-4.7', rate_limiter=None, cache=None):
+    """
+    为转发/引用推文生成摘要：原推概括已有，只把 builder 自己的评论叠加上去
+    比重新概括整段原文少发送原推全文的 token
+    """
+    prompt = SUMMARY_COMMENT_PROMPT.format(comment=comment, original_summary=original_summary)
+    cache_text = comment + "\n\n" + original_summary
+    return _cached_summary(prompt, cache_text, SUMMARY_COMMENT_PROMPT, api_key, model, rate_limiter, cache)
 
-    try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": "你是一个专业的AI技术推文分析师，擅长用简洁的语言概括推文要点。"},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.5,
-            max_tokens=800,
-            # 禁用思考模型，强制直接输出
-            extra_body={
-                "thinking": {
-                    "type": "disabled"
-                }
-            }
-        )
 
-        summary = response.choices[0].message.content.strip()
-        # 如果 content 为空，尝试使用 reasoning_content
-        if not summary and hasattr(response.choices[0].message, 'reasoning_content'):
-            summary = response.choices[0].message.reasoning_content.strip()
+def _cached_summary(prompt, cache_text, template, api_key, model, rate_limiter, cache):
+    """先查摘要缓存，未命中再限速调用 LLM 并写回缓存"""
+    if cache is None:
+        cache = get_summary_cache()
+    cache_key = summary_cache_key(cache_text, SUMMARY_SYSTEM_PROMPT + template, model)
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    if rate_limiter is not None:
+        rate_limiter.acquire(estimate_tokens(prompt) + SUMMARY_EXPECTED_OUTPUT_TOKENS)
+
+    try:
+        summary = _chat_completion(api_key, model, prompt, max_tokens=800)
         print(f"Generated summary: {summary[:50]}...")  # 添加日志
+        if cache is not None and summary:
+            cache.set(cache_key, summary, model)
         return summary
 
     except Exception as e:
+        # 失败文本只用于邮件展示，build_result 会把记录标记为 summary_failed，
+        # 入库后下次运行会重新生成（见 load_stored_summaries / rag_store.ingest_tweets）
         print(f"Error generating summary: {e}")
         import traceback
         traceback.print_exc()
-        return f"（摘要生成失败: {str(e)}）"
-
+        return f"{SUMMARY_FAILED_PREFIX}: {str(e)}）"
+
+
+def _chat_completion(api_key, model, prompt, max_tokens):
+    """调用摘要模型，返回回复文本"""
+    client = get_client("summary", api_key=api_key)
+
+    response = call_with_retry("summary", lambda: client.chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.5,
+        max_tokens=max_tokens,
+        # 禁用思考模型，强制直接输出
+        extra_body={
+            "thinking": {
+                "type": "disabled"
+            }
+        }
+    ))
+
+    content = (response.choices[0].message.content or '').strip()
+    # 如果 content 为空，尝试使用 reasoning_content
+    if not content and getattr(response.choices[0].message, 'reasoning_content', None):
+        content = response.choices[0].message.reasoning_content.strip()
+    return content
+
+
+def pack_batches(items, batch_size=SUMMARY_BATCH_SIZE, token_budget=SUMMARY_BATCH_TOKEN_BUDGET):
+    """
+    把 (key, text) 列表按条数上限与 token 预算切分为批次，保持原有顺序
+    单条超出预算的推文独占一个批次
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+    for key, text in items:
+        tokens = estimate_tokens(text)
+        if current and (len(current) >= batch_size or current_tokens + tokens > token_budget):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append((key, text))
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def parse_batch_response(content, expected_keys):
+    """
+    解析批量摘要的 JSON 输出，返回 {key: summary}
+    输出不是合法 JSON 数组时返回空字典；只保留 expected_keys 中的非空摘要
+    """
+    text = content.strip()
+    # 兼容模型用 ```json 代码块包裹输出
+    start = text.find('[')
+    end = text.rfind(']')
+    if start == -1 or end <= start:
+        return {}
+    try:
+        items = json.loads(text[start:end + 1])
+    except ValueError:
+        return {}
+    if not isinstance(items, list):
+        return {}
+
+    expected = set(expected_keys)
+    summaries = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        key = str(item.get('id', ''))
+        summary = item.get('summary')
+        if key in expected and isinstance(summary, str) and summary.strip():
+            summaries[key] = summary.strip()
+    return summaries
+
+
+def generate_batch_summaries(batch, api_key, model='glm-4.7', rate_limiter=None, cache=None):
+    """
+    用一次请求为一批推文生成摘要
+    batch: [(key, text)]，key 为批次内唯一的推文标识
+    返回 {key: summary}；批量输出缺失或格式错误的推文逐条回退到 generate_summary
+    """
+    if cache is None:
+        cache = get_summary_cache()
+    template = SUMMARY_SYSTEM_PROMPT + SUMMARY_BATCH_PROMPT
+    single_template = SUMMARY_SYSTEM_PROMPT + SUMMARY_PROMPT
+
+    summaries = {}
+    pending = []
+    for key, text in batch:
+        cached = None
+        if cache is not None:
+            # 批量输出缺失时逐条回退的摘要缓存在单条 Prompt 的键下，两种键都要查
+            cached = cache.get(summary_cache_key(text, template, model))
+            if cached is None:
+                cached = cache.get(summary_cache_key(text, single_template, model))
+        if cached is not None:
+            summaries[key] = cached
+        else:
+            pending.append((key, text))
+
+    if len(pending) == 1:
+        key, text = pending[0]
+        summaries[key] = generate_summary(text, api_key, model=model, rate_limiter=rate_limiter, cache=cache)
+        return summaries
+
+    if pending:
+        tweets_block = "\n\n".join(f"[id={key}]\n{text}" for key, text in pending)
+        prompt = SUMMARY_BATCH_PROMPT.format(count=len(pending), tweets_block=tweets_block)
+        max_tokens = min(4000, 300 * len(pending) + 200)
+
+        if rate_limiter is not None:
+            rate_limiter.acquire(estimate_tokens(prompt) + SUMMARY_EXPECTED_OUTPUT_TOKENS * len(pending))
+
+        parsed = {}
+        try:
+            content = _chat_completion(api_key, model, prompt, max_tokens=max_tokens)
+            parsed = parse_batch_response(content, [key for key, _ in pending])
+        except CircuitOpenError as e:
+            # 接口已熔断，逐条回退只会继续失败，直接标记为失败等待下次重新处理
+            print(f"Error generating batch summary: {e}")
+            for key, _ in pending:
+                summaries[key] = f"{SUMMARY_FAILED_PREFIX}: {str(e)}）"
+            return summaries
+        except Exception as e:
+            print(f"Error generating batch summary: {e}")
+
+        print(f"Batch of {len(pending)}: {len(parsed)} parsed, {len(pending) - len(parsed)} falling back")
+        for key, text in pending:
+            if key in parsed:
+                summaries[key] = parsed[key]
+                if cache is not None:
+                    cache.set(summary_cache_key(text, template, model), parsed[key], model)
+            else:
+                summaries[key] = generate_summary(text, api_key, model=model, rate_limiter=rate_limiter, cache=cache)
 
-def generate_summaries(tweets, api_key):
-    """为所有推文生成摘要"""
-    results = []
+    return summaries
 
-    print(f"Processing {len(tweets)} tweets...")
 
-    for i, tweet in enumerate(tweets):
-        # 使用 extract_full_text 提取完整推文内容（包括转发和引用）
-        text = extract_full_text(tweet)
-        print(f"Tweet {i+1}: {text[:80]}...")  # 添加日志
+def extract_username(tweet):
+    """获取推文作者用户名，兼容 Apify 的 user.legacy 结构"""
+    if 'user' in tweet:
+        user = tweet.get('user', {})
+        if 'legacy' in user:
+            return user['legacy'].get('screen_name', '')
+        return user.get('screen_name', '')
+    return tweet.get('username', '')
 
-        # 获取用户名
-        username = ''
-        if 'user' in tweet:
-            user = tweet.get('user', {})
-            if 'legacy' in user:
-                username = user['legacy'].get('screen_name', '')
-            else:
-                username = user.get('screen_name', '')
-        else:
-            username = tweet.get('username', '')
 
-        # 获取时间
-        datetime = tweet.get('created_at', '') or tweet.get('datetime', '')
+def shared_original(tweet):
+    """
+    识别转发/引用推文的原推，返回 (原推 key, 原推全文, builder 自己的评论)
+    纯转发的评论为空字符串；既不是转发也不是引用时返回 None
+    """
+    text = tweet.get('full_text') or tweet.get('text', '')
+    if 'retweeted_status' in tweet:
+        original = tweet['retweeted_status']
+        comment = '' if text.startswith('RT @') else text
+    elif 'quoted_status' in tweet:
+        original = tweet['quoted_status']
+        comment = text
+    else:
+        return None
+
+    # 纯转发时整条推文内容就是原推（extract_full_text 会带上原推的引用）
+    original_text = extract_full_text(tweet) if not comment else extract_full_text(original)
+    key = str(original.get('id_str') or original.get('id') or original.get('rest_id') or '')
+    if not key:
+        key = hashlib.sha1(original_text.encode('utf-8')).hexdigest()
+    return key, original_text, comment.strip()
+
+
+def group_shared_originals(tweets, indices):
+    """
+    把转发/引用同一原推的推文分组，只保留至少两条推文共享的原推
+    返回 {原推 key: (原推全文, [(推文下标, builder 评论)])}
+    """
+    groups = {}
+    for i in indices:
+        shared = shared_original(tweets[i])
+        if shared is None:
+            continue
+        key, original_text, comment = shared
+        groups.setdefault(key, (original_text, []))[1].append((i, comment))
+    return {key: group for key, group in groups.items() if len(group[1]) >= 2}
+
+
+def _tweet_field(tweet, *names):
+    """读取推文字段，兼容字段位于顶层或 legacy 结构中的两种 Apify 输出"""
+    legacy = tweet.get('legacy') or {}
+    for name in names:
+        value = tweet.get(name) or legacy.get(name)
+        if value:
+            return str(value)
+    return ''
+
+
+def _thread_sort_key(tweet):
+    """推文 ID 随时间递增，优先按 ID 排序，缺失时退回时间字符串"""
+    tid = tweet_id(tweet)
+    return (0, int(tid), '') if tid.isdigit() else (1, 0, tweet.get('created_at', '') or tweet.get('datetime', ''))
+
+
+def group_self_threads(tweets):
+    """
+    把同一 builder 的自回复推文串（thread）合并为一条推文，整串只概括一次、邮件中只出一张卡片
+    通过 in_reply_to_status_id 逐级找到串首；中间部分缺失时退回 conversation_id
+    合并后的推文沿用串首的 ID、链接与时间，full_text 为各部分 extract_full_text 按时间顺序拼接，
+    thread_ids 记录串内全部推文 ID。返回新的推文列表，串出现在其首条推文原来的位置。
+    """
+    by_id = {tweet_id(t): t for t in tweets if tweet_id(t)}
+
+    def _self_parent(tweet):
+        author = extract_username(tweet).lower()
+        parent_id = _tweet_field(tweet, 'in_reply_to_status_id_str', 'in_reply_to_status_id')
+        if not parent_id:
+            return None
+        parent = by_id.get(parent_id)
+        if parent is None:
+            # 中间部分不在本批数据中：回复自己且对话串首在本批数据中时，直接挂到串首
+            reply_to = _tweet_field(tweet, 'in_reply_to_screen_name').lower()
+            conversation_id = _tweet_field(tweet, 'conversation_id_str', 'conversation_id')
+            if reply_to != author or conversation_id == tweet_id(tweet):
+                return None
+            parent = by_id.get(conversation_id)
+        if parent is None or extract_username(parent).lower() != author:
+            return None
+        return parent
+
+    def _root(tweet):
+        seen = set()
+        while True:
+            seen.add(id(tweet))
+            parent = _self_parent(tweet)
+            if parent is None or id(parent) in seen:
+                return tweet
+            tweet = parent
+
+    threads = {}
+    for tweet in tweets:
+        threads.setdefault(id(_root(tweet)), []).append(tweet)
+
+    grouped = []
+    emitted = set()
+    thread_count = 0
+    for tweet in tweets:
+        key = id(_root(tweet))
+        if key in emitted:
+            continue
+        emitted.add(key)
+        parts = threads[key]
+        if len(parts) == 1:
+            grouped.append(tweet)
+            continue
+
+        parts = sorted(parts, key=_thread_sort_key)
+        merged = {k: v for k, v in parts[0].items() if k not in ('retweeted_status', 'quoted_status')}
+        merged['full_text'] = "\n\n".join(extract_full_text(part) for part in parts)
+        merged['thread_ids'] = [tweet_id(part) for part in parts]
+        grouped.append(merged)
+        thread_count += 1
+
+    if thread_count:
+        print(f"Threads: merged {len(tweets) - len(grouped) + thread_count} tweets into {thread_count} threads")
+    return grouped
+
+
+def tweet_id(tweet):
+    """获取推文 ID（与 rag_store.tweet_id_hash 的取值方式一致）"""
+    raw_id = tweet.get('id') or tweet.get('id_str', '')
+    return str(raw_id) if raw_id else ''
+
+
+def is_failed_summary(summary):
+    """摘要是否为生成失败的占位文本"""
+    return (summary or '').startswith(SUMMARY_FAILED_PREFIX)
+
+
+def load_stored_summaries(tweets):
+    """
+    在调用 LLM 前查询 RAG 库，返回已入库推文的摘要 {tweet_id: summary}
+    生成失败的旧摘要不复用，让它们重新生成；
+    合并后的推文串包含库中记录没有覆盖的推文时（首条曾单独入库）也不复用，重新概括整串
+    """
+    thread_ids = {
+        tweet_id(t): {str(i) for i in t.get('thread_ids') or [tweet_id(t)]}
+        for t in tweets
+    }
+    ids = [tid for tid in thread_ids if tid]
+    if not ids:
+        return {}
 
-        # 获取URL
-        url = tweet.get('url', '')
+    try:
+        from scripts.rag_store import get_stored_tweets
+        stored = get_stored_tweets(ids)
+    except Exception as e:
+        print(f"Warning: failed to load stored tweets ({e}), summarizing everything")
+        return {}
+
+    summaries = {}
+    for tid, record in stored.items():
+        metadata = record.get('metadata', {})
+        summary = metadata.get('summary', '')
+        stored_ids = {str(i) for i in metadata.get('thread_ids') or [tid]}
+        if not thread_ids.get(tid, set()) <= stored_ids:
+            continue
+        if summary and not metadata.get('summary_failed') and not is_failed_summary(summary):
+            summaries[tid] = summary
+    return summaries
+
+
+def build_result(tweet, text, summary):
+    """
+    组装输出记录（字段与 summarized_tweets.json 保持一致）
+    自回复推文串额外带上 thread_ids；摘要生成失败时额外带上 summary_failed 标记，
+    供断点续跑和入库时识别、重新处理
+    """
+    result = {
+        'id': tweet.get('id', tweet.get('id_str', '')),
+        'url': tweet.get('url', ''),
+        'text': text,
+        'summary': summary,
+        'username': extract_username(tweet),
+        'datetime': tweet.get('created_at', '') or tweet.get('datetime', '')
+    }
+    if tweet.get('thread_ids'):
+        result['thread_ids'] = tweet['thread_ids']
+    if is_failed_summary(summary):
+        result['summary_failed'] = True
+    return result
+
+
+def generate_summaries(tweets, api_key, max_in_flight=None, rate_limiter=None, stored_summaries=None,
+                       batch_size=None, on_result=None):
+    """
+    为所有推文并发生成摘要，结果顺序与输入一致
+    max_in_flight: 同时在途的请求数，默认 SUMMARY_MAX_IN_FLIGHT
+    rate_limiter: 限速器，默认按 SUMMARY_RPS / SUMMARY_TPM 创建
+    stored_summaries: 可选，{tweet_id: summary}，命中的推文直接复用已入库摘要
+    batch_size: 每次请求打包的推文数，默认 SUMMARY_BATCH_SIZE；为 1 时逐条请求
+    on_result: 可选回调 on_result(index, result)，每条摘要完成时（按完成顺序）在调用线程中触发
+    """
+    max_in_flight = max(1, max_in_flight or SUMMARY_MAX_IN_FLIGHT)
+    batch_size = max(1, batch_size or SUMMARY_BATCH_SIZE)
+    if rate_limiter is None:
+        rate_limiter = RateLimiter()
+    stored_summaries = stored_summaries or {}
+
+    print(f"Processing {len(tweets)} tweets (max in flight: {max_in_flight}, batch size: {batch_size})...")
+
+    # 使用 extract_full_text 提取完整推文内容（包括转发和引用）
+    texts = [extract_full_text(tweet) for tweet in tweets]
+    ids = [tweet_id(tweet) for tweet in tweets]
+
+    results = [None] * len(tweets)
+
+    def _complete(i, summary):
+        results[i] = build_result(tweets[i], texts[i], summary)
+        if on_result is not None:
+            on_result(i, results[i])
+
+    pending = []
+    reused = 0
+    triaged = 0
+    for i, tid in enumerate(ids):
+        if tid in stored_summaries:
+            _complete(i, stored_summaries[tid])
+            reused += 1
+        elif not texts[i]:
+            _complete(i, "（空推文）")
+        elif is_content_free(texts[i]):
+            _complete(i, INSUFFICIENT_SUMMARY)
+            triaged += 1
+        else:
+            pending.append(i)
+
+    if reused:
+        print(f"Reusing stored summaries for {reused} already-ingested tweets")
+    if triaged:
+        print(f"Triage: {triaged} content-free tweets, saved {triaged} LLM calls")
+
+    # 多位 builder 转发/引用同一条原推时，原推只概括一次
+    groups = group_shared_originals(tweets, pending)
+    grouped = {i for _, members in groups.values() for i, _ in members}
+    if groups:
+        print(f"Dedup: {len(grouped)} tweets share {len(groups)} originals")
+    jobs = [(i, texts[i]) for i in pending if i not in grouped]
+    jobs += [(('original', key), original_text) for key, (original_text, _) in groups.items()]
+
+    original_summaries = {}
+
+    def _on_job_done(key, summary):
+        if isinstance(key, tuple):
+            original_summaries[key[1]] = summary
+        else:
+            _complete(key, summary)
+
+    def _summarize(job):
+        key, text = job
+        print(f"Summarizing: {text[:80]}...")  # 添加日志
+        return generate_summary(text, api_key, rate_limiter=rate_limiter)
+
+    def _summarize_batch(batch):
+        # 批次内用 1..N 的短序号作为推文 ID：比 19 位推文 ID 更不容易被模型抄错，
+        # 也不会因缺失或重复的推文 ID 互相覆盖
+        keyed = [(str(n), text) for n, (_, text) in enumerate(batch, 1)]
+        batch_summaries = generate_batch_summaries(keyed, api_key, rate_limiter=rate_limiter)
+        return [batch_summaries[key] for key, _ in keyed]
+
+    # 按完成顺序回调，结果按下标写回，保证返回顺序与输入一致
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        if batch_size > 1:
+            batches = pack_batches(jobs, batch_size=batch_size)
+            print(f"Packed {len(jobs)} summaries into {len(batches)} requests")
+            futures = {pool.submit(_summarize_batch, batch): batch for batch in batches}
+            for future in as_completed(futures):
+                for (key, _), summary in zip(futures[future], future.result()):
+                    _on_job_done(key, summary)
+        else:
+            futures = {pool.submit(_summarize, job): job[0] for job in jobs}
+            for future in as_completed(futures):
+                _on_job_done(futures[future], future.result())
+
+        # 第二阶段：纯转发直接复用原推摘要，带评论的只把评论叠加到原推摘要上
+        futures = {}
+        for key, (_, members) in groups.items():
+            original_summary = original_summaries[key]
+            for i, comment in members:
+                if not comment or is_content_free(comment) or is_failed_summary(original_summary):
+                    _complete(i, original_summary)
+                else:
+                    future = pool.submit(
+                        generate_comment_summary, comment, original_summary, api_key, rate_limiter=rate_limiter,
+                    )
+                    futures[future] = i
+        for future in as_completed(futures):
+            _complete(futures[future], future.result())
+
+    cache = get_summary_cache()
+    if cache is not None:
+        stats = cache.stats()
+        print(f"Summary cache: {stats['hits']} hits, {stats['misses']} misses, {stats['size']} entries")
 
-        summary = generate_summary(text, api_key)
+    return results
 
-        # 添加延迟避免速率限制
-        time.sleep(1)
 
-        result = {
-            'id': tweet.get('id', tweet.get('id_str', '')),
-            'url': url,
-            'text': text,
-            'summary': summary,
-            'username': username,
-            'datetime': datetime
-        }
+def iter_tweet_records(path):
+    """
+    逐条读取推文记录，不把整个文件载入内存
+    支持 JSON 数组（Apify 导出格式）与 JSONL 两种格式
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buf = f.read(65536)
+        stripped = buf.lstrip()
+        if not stripped.startswith('['):
+            # JSONL：逐行解析
+            f.seek(0)
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        # JSON 数组：跳过 '['，逐个 raw_decode 数组元素
+        buf = stripped[1:]
+        eof = False
+        while True:
+            buf = buf.lstrip().lstrip(',').lstrip()
+            if buf.startswith(']'):
+                return
+            try:
+                record, end = decoder.raw_decode(buf)
+            except ValueError:
+                if eof:
+                    raise
+                chunk = f.read(65536)
+                if not chunk:
+                    eof = True
+                buf += chunk
+                continue
+            yield record
+            buf = buf[end:]
+
+
+def _repair_jsonl(path):
+    """截掉上次崩溃时写了一半的最后一行，返回已完成记录的 ID 集合"""
+    done_ids = set()
+    if not os.path.exists(path):
+        return done_ids
+
+    valid_size = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            valid_size += len(line)
+            # 生成失败的记录不算完成，重启后重新生成
+            if record.get('id') and not record.get('summary_failed'):
+                done_ids.add(str(record['id']))
+
+    if valid_size != os.path.getsize(path):
+        with open(path, 'r+b') as f:
+            f.truncate(valid_size)
+    return done_ids
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def summarize_stream(input_file, output_file, api_key, chunk_size=None):
+    """
+    流式摘要：分块读取输入，每条摘要完成后立即追加写入 JSONL，中途崩溃不丢已完成的结果
+    output_file 以 .jsonl 结尾时直接写 JSONL；否则先写 <output_file>.partial.jsonl 检查点，
+    全部完成后按输入顺序转成 JSON 数组（兼容 send_email.py / rag_store.py）并删除检查点
+    重启时跳过检查点中已有的推文 ID。返回本次新写入的条数。
+    """
+    chunk_size = max(1, chunk_size or SUMMARY_STREAM_CHUNK)
+    as_jsonl = output_file.endswith('.jsonl')
+    checkpoint = output_file if as_jsonl else output_file + '.partial.jsonl'
+
+    done_ids = _repair_jsonl(checkpoint)
+    if done_ids:
+        print(f"Resuming: {len(done_ids)} tweets already in {checkpoint}")
+
+    input_ids = []
+    written = 0
+    with open(checkpoint, 'a', encoding='utf-8') as out:
+        def _append(i, result):
+            out.write(json.dumps(result, ensure_ascii=False) + '\n')
+            out.flush()
+
+        for chunk in _chunks(iter_tweet_records(input_file), chunk_size):
+            # 同一块内的自回复推文串合并为一条（跨块的推文串不合并）
+            if SUMMARY_GROUP_THREADS:
+                chunk = group_self_threads(chunk)
+            input_ids.extend(tweet_id(t) for t in chunk)
+            tweets = [t for t in chunk if not tweet_id(t) or tweet_id(t) not in done_ids]
+            if not tweets:
+                continue
+
+            # 预过滤：已入库的推文复用库中摘要或直接丢弃，只为新推文调用 LLM
+            stored_summaries = {}
+            if SUMMARY_STORED_MODE in ('reuse', 'drop'):
+                stored_summaries = load_stored_summaries(tweets)
+                if SUMMARY_STORED_MODE == 'drop':
+                    before = len(tweets)
+                    tweets = [t for t in tweets if tweet_id(t) not in stored_summaries]
+                    print(f"Dropped {before - len(tweets)} already-ingested tweets")
+                    stored_summaries = {}
+
+            results = generate_summaries(tweets, api_key, stored_summaries=stored_summaries, on_result=_append)
+            written += len(results)
+            done_ids.update(str(r['id']) for r in results if r['id'] and not r.get('summary_failed'))
+
+    if not as_jsonl:
+        _write_json_array(checkpoint, output_file, input_ids)
+        os.remove(checkpoint)
+
+    return written
+
+
+def _write_json_array(jsonl_path, json_path, input_ids):
+    """
+    把 JSONL 检查点按输入顺序写成 JSON 数组（与旧版 summarized_tweets.json 格式一致）
+    每个 ID 只输出一条：最新的成功记录，没有成功记录时取最新的失败记录；不在本次输入中的 ID 不输出
+    """
+    by_id = {}
+    no_id = []
+    for record in iter_tweet_records(jsonl_path):
+        if not record.get('id'):
+            no_id.append(record)
+            continue
+        tid = str(record['id'])
+        # 断点续跑时同一推文可能多次写入：后写的覆盖先写的，但失败记录不覆盖成功记录
+        if tid not in by_id or not record.get('summary_failed') or by_id[tid].get('summary_failed'):
+            by_id[tid] = record
 
-        results.append(result)
+    results = []
+    for tid in input_ids:
+        if tid and tid in by_id:
+            results.append(by_id.pop(tid))
+    # 没有 ID 的记录无法去重，按写入顺序追加
+    results.extend(no_id)
 
-    return results
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
 
 
 if __name__ == '__main__':
-    # 测试代码
-    import sys
-
     if len(sys.argv) < 2:
         print("Usage: python summarize.py <input_file> [output_file]")
+        print("  output_file 以 .jsonl 结尾时逐条追加写入 JSONL，否则输出 JSON 数组")
         sys.exit(1)
 
     input_file = sys.argv[1]
     output_file = sys.argv[2] if len(sys.argv) > 2 else 'summarized_tweets.json'
 
-    # 读取推文数据
-    with open(input_file, 'r', encoding='utf-8') as f:
-        tweets = json.load(f)
-
     # 获取API Key
     api_key = os.environ.get('ZHIPU_API_KEY', '')
 
@@ -162,12 +888,13 @@ if __name__ == '__main__':
         print("Error: ZHIPU_API_KEY not set")
         sys.exit(1)
 
-    # 生成摘要
-    print(f"Generating summaries for {len(tweets)} tweets...")
-    results = generate_summaries(tweets, api_key)
+    # 流式生成摘要：边读边写，中断后重跑会跳过已完成的推文
+    written = summarize_stream(input_file, output_file, api_key)
 
-    # 保存结果
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
+    # 关闭缓存，确保 WAL 内容落盘（CI 中缓存文件会被 actions/cache 保存）
+    cache = get_summary_cache()
+    if cache is not None:
+        cache.close()
 
-    print(f"Summaries saved to {output_file}")
+    print(f"Summaries saved to {output_file} ({written} new)")
+    print_metrics_summary()
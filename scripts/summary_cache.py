@@ -0,0 +1,122 @@
+"""
+摘要缓存模块
+以 (推文全文, Prompt 模板, 模型名) 的哈希为键，把已生成的摘要持久化到本地 SQLite，
+避免重叠时间窗口、重跑 backfill 或重试 daily 时重复调用 LLM
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+SUMMARY_CACHE_PATH = os.environ.get(
+    "SUMMARY_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "summary_cache.sqlite"),
+)
+# 最多保留的条目数（超出时按最近使用时间淘汰）
+SUMMARY_CACHE_MAX_ENTRIES = int(os.environ.get("SUMMARY_CACHE_MAX_ENTRIES", "50000"))
+# 条目最长保留天数（按写入时间）
+SUMMARY_CACHE_MAX_AGE_DAYS = float(os.environ.get("SUMMARY_CACHE_MAX_AGE_DAYS", "90"))
+
+
+def summary_cache_key(text, prompt_template, model):
+    """计算缓存键：推文全文、Prompt 模板与模型名共同决定摘要结果"""
+    payload = json.dumps([model, prompt_template, text], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SummaryCache:
+    """基于 SQLite 的摘要缓存，线程安全，带容量与过期淘汰"""
+
+    def __init__(self, path=SUMMARY_CACHE_PATH, max_entries=SUMMARY_CACHE_MAX_ENTRIES,
+                 max_age_days=SUMMARY_CACHE_MAX_AGE_DAYS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_days * 86400
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            " key TEXT PRIMARY KEY,"
+            " summary TEXT NOT NULL,"
+            " model TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_summaries_last_used ON summaries(last_used)")
+        self._conn.commit()
+        self.evict()
+
+    def get(self, key):
+        """命中返回摘要并刷新最近使用时间，未命中返回 None"""
+        with self._lock:
+            row = self._conn.execute("SELECT summary FROM summaries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE summaries SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def set(self, key, summary, model):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO summaries (key, summary, model, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, summary, model, now, now),
+            )
+            self._conn.commit()
+
+    def evict(self):
+        """删除过期条目，并把总条目数压到 max_entries 以内。返回删除条数。"""
+        with self._lock:
+            removed = 0
+            if self.max_age_seconds > 0:
+                cutoff = time.time() - self.max_age_seconds
+                removed += self._conn.execute("DELETE FROM summaries WHERE created_at < ?", (cutoff,)).rowcount
+            if self.max_entries > 0:
+                count = self._conn.execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+                overflow = count - self.max_entries
+                if overflow > 0:
+                    removed += self._conn.execute(
+                        "DELETE FROM summaries WHERE key IN "
+                        "(SELECT key FROM summaries ORDER BY last_used ASC LIMIT ?)",
+                        (overflow,),
+                    ).rowcount
+            self._conn.commit()
+        if removed:
+            print(f"Summary cache: evicted {removed} entries")
+        return removed
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "size": size}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_summary_cache():
+    """获取进程级默认缓存；SUMMARY_CACHE_PATH 设为空字符串时禁用缓存，返回 None"""
+    global _default_cache
+    if not SUMMARY_CACHE_PATH:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = SummaryCache()
+        return _default_cache
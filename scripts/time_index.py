@@ -0,0 +1,78 @@
+"""
+推文时间索引模块
+发布时间统一规整为 Unix 时间戳（UTC），记录序号按时间排序：
+最近 N 天窗口用 bisect 定位后切片，每个 builder 另有一份按时间排序的序号，用于「最近 N 条」查询
+"""
+
+from bisect import bisect_left
+from calendar import timegm
+from datetime import datetime
+
+from scripts.compact_record import meta_get
+
+
+# 推文 datetime 字段的常见格式；Twitter 原生格式（Tue Mar 10 04:32:54 +0000 2026）放在最前，它占存量数据的大多数
+TWEET_TIME_FORMATS = [
+    "%a %b %d %H:%M:%S +0000 %Y",
+    "%Y-%m-%dT%H:%M:%S.%fZ",
+    "%Y-%m-%dT%H:%M:%SZ",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d",
+]
+
+
+def parse_timestamp(dt_str):
+    """把推文 datetime 字符串解析为 UTC Unix 时间戳；无法解析时返回 0"""
+    dt_str = (dt_str or "").strip()
+    if not dt_str:
+        return 0
+    for fmt in TWEET_TIME_FORMATS:
+        try:
+            return timegm(datetime.strptime(dt_str[:30], fmt).timetuple())
+        except ValueError:
+            continue
+    return 0
+
+
+def record_timestamp(record):
+    """记录的发布时间：优先用入库时写入的 unix_timestamp，旧数据缺失时解析 datetime"""
+    return int(meta_get(record, "unix_timestamp") or 0) or parse_timestamp(meta_get(record, "datetime", ""))
+
+
+class TimeIndex:
+    """基于一组只读记录构建的时间索引；记录变化后重新构建"""
+
+    def __init__(self, records):
+        self.records = records
+        dated = []
+        self.undated = []
+        for i, r in enumerate(records):
+            ts = record_timestamp(r)
+            if ts:
+                dated.append((ts, i))
+            else:
+                self.undated.append(i)
+        dated.sort()
+        self.timestamps = [ts for ts, _ in dated]
+        self.order = [i for _, i in dated]
+
+        self.by_username = {}
+        for i in self.order:
+            username = (meta_get(records[i], "username", "") or "").lower()
+            self.by_username.setdefault(username, []).append(i)
+
+    def since(self, since_ts):
+        """发布时间 >= since_ts 的记录（按时间升序），无法解析时间的记录保留在末尾"""
+        start = bisect_left(self.timestamps, since_ts)
+        return [self.records[i] for i in self.order[start:]] + [self.records[i] for i in self.undated]
+
+    def between(self, start_ts, end_ts):
+        """发布时间在 [start_ts, end_ts) 内的记录（按时间升序）"""
+        start = bisect_left(self.timestamps, start_ts)
+        end = bisect_left(self.timestamps, end_ts)
+        return [self.records[i] for i in self.order[start:end]]
+
+    def latest(self, username, n):
+        """某个 builder 最新的 n 条记录（按时间降序）；username 不区分大小写"""
+        rows = self.by_username.get((username or "").lower(), [])
+        return [self.records[i] for i in reversed(rows[-n:])] if n > 0 else []
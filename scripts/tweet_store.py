@@ -0,0 +1,149 @@
+"""
+SQLite 推文存储后端
+替代整文件重写的 data/tweets_store.json：WAL 模式，按 id / username / unix_timestamp 建索引，
+新推文增量插入。记录格式与 JSON 存储一致：{"id", "document", "metadata"}
+"""
+
+import os
+import json
+import sqlite3
+
+
+TWEETS_DB_PATH = os.environ.get(
+    "TWEETS_DB_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "tweets_store.sqlite"),
+)
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS tweets ("
+    " id TEXT PRIMARY KEY,"
+    " username TEXT NOT NULL DEFAULT '',"
+    " unix_timestamp INTEGER NOT NULL DEFAULT 0,"
+    " document TEXT NOT NULL DEFAULT '',"
+    " metadata TEXT NOT NULL DEFAULT '{}')",
+    "CREATE INDEX IF NOT EXISTS idx_tweets_username ON tweets(username)",
+    "CREATE INDEX IF NOT EXISTS idx_tweets_unix_timestamp ON tweets(unix_timestamp)",
+)
+
+# SQLite 单条语句的参数个数上限较低，IN 查询分批进行
+_IN_BATCH = 500
+
+
+def connect(db_path=None):
+    """打开数据库连接（WAL 模式），首次使用时建表建索引"""
+    path = db_path or TWEETS_DB_PATH
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    for statement in _SCHEMA:
+        conn.execute(statement)
+    return conn
+
+
+def _to_row(record):
+    meta = record.get("metadata", {}) or {}
+    return (
+        str(record["id"]),
+        str(meta.get("username", "")).lower(),
+        int(meta.get("unix_timestamp") or 0),
+        record.get("document", ""),
+        json.dumps(meta, ensure_ascii=False),
+    )
+
+
+def _from_row(row):
+    return {"id": row[0], "document": row[1], "metadata": json.loads(row[2])}
+
+
+def load_all(db_path=None):
+    """按插入顺序读取全部记录"""
+    conn = connect(db_path)
+    try:
+        rows = conn.execute("SELECT id, document, metadata FROM tweets ORDER BY rowid").fetchall()
+    finally:
+        conn.close()
+    return [_from_row(row) for row in rows]
+
+
+def replace_all(records, db_path=None):
+    """用 records 整体替换库中数据（单个事务）"""
+    conn = connect(db_path)
+    try:
+        with conn:
+            conn.execute("DELETE FROM tweets")
+            conn.executemany("INSERT OR REPLACE INTO tweets VALUES (?, ?, ?, ?, ?)", [_to_row(r) for r in records])
+    finally:
+        conn.close()
+
+
+def upsert(records, db_path=None):
+    """增量插入或覆盖记录，返回写入条数"""
+    if not records:
+        return 0
+    conn = connect(db_path)
+    try:
+        with conn:
+            conn.executemany(
+                "INSERT INTO tweets VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET username = excluded.username, "
+                "unix_timestamp = excluded.unix_timestamp, document = excluded.document, "
+                "metadata = excluded.metadata",
+                [_to_row(r) for r in records],
+            )
+    finally:
+        conn.close()
+    return len(records)
+
+
+def delete(ids, db_path=None):
+    """按 ID 删除记录，返回删除条数"""
+    ids = [str(i) for i in ids]
+    if not ids:
+        return 0
+    deleted = 0
+    conn = connect(db_path)
+    try:
+        with conn:
+            for i in range(0, len(ids), _IN_BATCH):
+                batch = ids[i:i + _IN_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                deleted += conn.execute(f"DELETE FROM tweets WHERE id IN ({placeholders})", batch).rowcount
+    finally:
+        conn.close()
+    return deleted
+
+
+def get_by_ids(ids, db_path=None):
+    """按 ID 批量查询，返回 {id: record}"""
+    ids = [str(i) for i in ids]
+    found = {}
+    conn = connect(db_path)
+    try:
+        for i in range(0, len(ids), _IN_BATCH):
+            batch = ids[i:i + _IN_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(
+                f"SELECT id, document, metadata FROM tweets WHERE id IN ({placeholders})", batch,
+            ).fetchall()
+            for row in rows:
+                found[row[0]] = _from_row(row)
+    finally:
+        conn.close()
+    return found
+
+
+def all_ids(db_path=None):
+    conn = connect(db_path)
+    try:
+        return {row[0] for row in conn.execute("SELECT id FROM tweets")}
+    finally:
+        conn.close()
+
+
+def count(db_path=None):
+    conn = connect(db_path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM tweets").fetchone()[0]
+    finally:
+        conn.close()